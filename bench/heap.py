@@ -1,35 +1,67 @@
 import random
-import heapq
 import time
 
-heaps = []
+import vanilla.core
 
 
 def benchmark(name, n, f):
     start = time.time()
     for i in xrange(n):
         f()
-    print '%-20s %8.2f' % (name, n / (time.time() - start))
+    print '%-30s %12.2f' % (name, n / (time.time() - start))
 
 
-def push():
-    h = []
-    for i in xrange(1000):
-        heapq.heappush(h, (random.random(), i))
-    heaps.append(h)
+def compare(name, n, f):
+    for scheduler in (vanilla.core.Scheduler, vanilla.core.TimerWheel):
+        benchmark(
+            '%s (%s)' % (name, scheduler.__name__), n,
+            lambda: f(scheduler))
 
 
-def pop():
-    h = heaps.pop()
-    while h:
-        heapq.heappop(h)
+def push(scheduler, size=1000):
+    s = scheduler()
+    for i in xrange(size):
+        s.add(random.random() * 60000, i)
+    return s
 
 
-benchmark("push", 100, push)
-benchmark("pop", 100, pop)
+def push_pop(scheduler):
+    s = push(scheduler)
+    while s:
+        s.pop()
 
-benchmark("push", 100, push)
-benchmark("pop", 100, pop)
 
-benchmark("push", 100, push)
-benchmark("pop", 100, pop)
+def push_cancel(scheduler):
+    # the common case for timeouts: nearly all are cancelled before they fire
+    s = push(scheduler)
+    items = [s.add(random.random() * 60000, i) for i in xrange(1000)]
+    for item in items:
+        s.remove(item)
+    s.timeout()
+
+
+def pending(scheduler, size=100000):
+    # a hub with a large number of pending timeouts, adding and cancelling one
+    # more per in-flight request
+    s = push(scheduler, size)
+    start = time.time()
+    for i in xrange(size):
+        item = s.add(random.random() * 60000, i)
+        s.remove(item)
+        s.timeout()
+    # entries held by the scheduler after the run, including cancelled ones
+    retained = len(getattr(s, 'queue', ())) or len(s)
+    print '%-30s %12.2f %8s retained' % (
+        'pending %s (%s)' % (size, scheduler.__name__),
+        size / (time.time() - start),
+        retained)
+
+
+if __name__ == '__main__':
+    for _ in xrange(3):
+        compare('push', 100, push)
+        compare('push/pop', 100, push_pop)
+        compare('push/cancel', 100, push_cancel)
+
+    pending(vanilla.core.Scheduler)
+    pending(vanilla.core.TimerWheel)
@@ -0,0 +1,65 @@
+import platform
+import time
+
+import vanilla
+import vanilla.message
+
+
+def benchmark(name, n, f):
+    start = time.time()
+    f(n)
+    print '%-30s %12.2f' % (name, n / (time.time() - start))
+
+
+def sender_recver(pair):
+    # send from a green thread, recv from the main one
+    def _(n):
+        h = pair.sender.hub
+
+        @h.spawn
+        def _():
+            for i in xrange(n):
+                pair.send(i)
+
+        for i in xrange(n):
+            pair.recv()
+    return _
+
+
+def state(h):
+    def _(n):
+        s = h.state()
+        for i in xrange(n):
+            s.send(i)
+            s.recv()
+    return _
+
+
+def stream(h):
+    def _(n):
+        sender, recver = vanilla.message.Stream(h)
+
+        @h.spawn
+        def _():
+            for i in xrange(n):
+                sender.send('line %s\n' % i)
+
+        for i in xrange(n):
+            recver.recv_line()
+    return _
+
+
+if __name__ == '__main__':
+    print '%s %s' % (
+        platform.python_implementation(), platform.python_version())
+
+    h = vanilla.Hub()
+    n = 100000
+    for _ in xrange(3):
+        benchmark('pipe', n, sender_recver(h.pipe()))
+        benchmark('dealer', n, sender_recver(h.dealer()))
+        benchmark('router', n, sender_recver(h.router()))
+        benchmark('queue', n, sender_recver(h.queue(100)))
+        benchmark('channel', n, sender_recver(h.channel()))
+        benchmark('state', n, state(h))
+        benchmark('stream', n, stream(h))
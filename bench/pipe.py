@@ -0,0 +1,49 @@
+import resource
+import time
+import sys
+import gc
+
+import vanilla
+
+
+def footprint(pair):
+    """
+    Bytes used by a single Pipe: the Pair, both ends, the middle object, the
+    weakrefs between them and any instance dicts.
+    """
+    middle = pair.sender.middle
+    objects = [
+        pair, pair.sender, pair.recver, middle, middle.sender, middle.recver]
+    total = 0
+    for ob in objects:
+        total += sys.getsizeof(ob)
+        # only count dicts which have actually been allocated
+        total += sum(
+            sys.getsizeof(x) for x in gc.get_referents(ob) if type(x) is dict)
+    return total
+
+
+def rss(n):
+    """
+    Resident bytes per live Pipe, with *n* Pipes alive.
+    """
+    h = vanilla.Hub()
+    gc.collect()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    pipes = [h.pipe() for _ in xrange(n)]
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux, bytes on osx
+    scale = 1 if sys.platform == 'darwin' else 1024
+    assert len(pipes) == n
+    return (after - before) * scale / float(n), n / elapsed
+
+
+if __name__ == '__main__':
+    h = vanilla.Hub()
+    print '%-30s %12s' % ('footprint (bytes/pipe)', footprint(h.pipe()))
+    n = 1000000
+    per_pipe, rate = rss(n)
+    print '%-30s %12.1f' % ('rss (bytes/pipe)', per_pipe)
+    print '%-30s %12.2f' % ('pipes created/s', rate)
@@ -0,0 +1,65 @@
+import time
+
+import vanilla
+import vanilla.http
+
+
+def serve(h, delay):
+    # replies to each request *delay* ms after it's read, without holding up
+    # reading the requests behind it, like a backend with some latency
+    server = h.http.listen()
+
+    def reply(request):
+        request.reply(vanilla.http.Status(200), {}, 'ok')
+
+    @server.consume
+    def _(conn):
+        @h.spawn
+        def _():
+            for request in conn:
+                if delay:
+                    h.spawn_later(delay, reply, request)
+                else:
+                    reply(request)
+
+    return server
+
+
+def serial(h, server, n, name):
+    # each request waits for the previous response
+    conn = h.http.connect('http://localhost:%s' % server.port)
+    start = time.time()
+    for i in xrange(n):
+        conn.get('/').recv().consume()
+    print '%-30s %12.2f' % (name, n / (time.time() - start))
+    conn.close()
+
+
+def pipelined(h, server, n, depth, name):
+    # up to *depth* requests are in flight, with responses consumed in order
+    conn = h.http.connect('http://localhost:%s' % server.port, depth=depth)
+    responses = h.queue(n)
+
+    @h.spawn
+    def _():
+        for i in xrange(n):
+            responses.send(conn.get('/'))
+
+    start = time.time()
+    for i in xrange(n):
+        responses.recv().recv().consume()
+    print '%-30s %12.2f' % (
+        '%s (depth %s)' % (name, depth), n / (time.time() - start))
+    conn.close()
+
+
+if __name__ == '__main__':
+    h = vanilla.Hub()
+    for delay in (0, 1):
+        server = serve(h, delay)
+        name = 'delay %sms' % delay
+        for _ in xrange(2):
+            serial(h, server, 1000, 'serial %s' % name)
+            for depth in (4, 16, 64):
+                pipelined(h, server, 1000, depth, 'pipelined %s' % name)
+        server.close()
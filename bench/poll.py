@@ -0,0 +1,37 @@
+import time
+
+import vanilla
+import vanilla.poll
+
+
+def pingpong(name, idle, n=10000):
+    # round trips between two green threads over a pair of os pipes, with
+    # *idle* other pipes registered on the hub
+    h = vanilla.Hub(poll=name)
+    pipes = [h.io.pipe() for _ in xrange(idle)]
+
+    ping = h.io.pipe()
+    pong = h.io.pipe()
+
+    @h.spawn
+    def _():
+        for x in ping.recver:
+            pong.send(x)
+
+    start = time.time()
+    for i in xrange(n):
+        ping.send('x')
+        pong.recv()
+    print '%-30s %12.2f' % (
+        '%s (%s idle)' % (name, idle), n / (time.time() - start))
+
+    for pipe in pipes + [ping, pong]:
+        pipe.sender.close()
+        pipe.recver.close()
+
+
+if __name__ == '__main__':
+    # select is limited to fds below FD_SETSIZE, so keep below 1024 fds
+    for idle in (10, 100, 400):
+        for name in vanilla.poll.backends:
+            pingpong(name, idle)
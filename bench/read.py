@@ -0,0 +1,35 @@
+import socket
+import time
+
+import vanilla
+
+
+def transfer(h, size, read_size, into):
+    # a unix socketpair streaming *size* bytes, read back with recv_n
+    a, b = socket.socketpair()
+    sender = h.io.socket(a).sender
+    recver = h.io.socket(b, size=read_size, into=into).recver
+    chunk = 'x' * 65536
+
+    @h.spawn
+    def _():
+        for i in xrange(size // len(chunk)):
+            sender.send(chunk)
+
+    start = time.time()
+    got = recver.recv_n(size)
+    elapsed = time.time() - start
+    assert len(got) == size
+    print '%-30s %12.2f MB/s' % (
+        '%sKB reads%s' % (read_size >> 10, ' (into)' if into else ''),
+        (size >> 20) / elapsed)
+    sender.close()
+    recver.close()
+
+
+if __name__ == '__main__':
+    h = vanilla.Hub()
+    for _ in xrange(3):
+        for read_size in (16384, 262144):
+            transfer(h, 200 << 20, read_size, False)
+            transfer(h, 200 << 20, read_size, True)
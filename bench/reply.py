@@ -0,0 +1,38 @@
+import json
+import time
+import os
+
+import vanilla
+import vanilla.http
+import vanilla.message
+
+
+REQUEST = 'GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n'
+BODY = json.dumps({'ok': True, 'id': 12345, 'tags': ['a', 'b']})
+
+
+def replies(h, n):
+    # replies to *n* requests with a small JSON body. the requests are read
+    # up front, and the responses are written to /dev/null, so only the cost
+    # of producing each response is measured
+    sender = h.io.fd_out(os.open(os.devnull, os.O_WRONLY))
+    stream = vanilla.message.Stream(h)
+    stream.recver.buffer += REQUEST * n
+    server = vanilla.http.HTTPServer(
+        h, vanilla.message.Pair(sender, stream.recver))
+    requests = [server.recv() for i in xrange(n)]
+
+    start = time.time()
+    for request in requests:
+        request.reply(
+            vanilla.http.Status(200),
+            {'Content-Type': 'application/json'},
+            BODY)
+    print '%-30s %12.2f' % ('json replies', n / (time.time() - start))
+    sender.close()
+
+
+if __name__ == '__main__':
+    h = vanilla.Hub()
+    for _ in xrange(3):
+        replies(h, 20000)
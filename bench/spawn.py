@@ -0,0 +1,42 @@
+import time
+
+import vanilla
+
+
+def benchmark(name, n, f):
+    start = time.time()
+    for i in xrange(n):
+        f()
+    print '%-30s %12.2f' % (name, n / (time.time() - start))
+
+
+def spawn(h, size=1000):
+    def task(i):
+        pass
+
+    def _():
+        for i in xrange(size):
+            h.spawn(task, i)
+        h.sleep(0)
+    return _
+
+
+def pipe(h, size=1000):
+    # short lived handlers, each passing a single message
+    def task(sender, i):
+        sender.send(i)
+
+    def _():
+        for i in xrange(size):
+            sender, recver = h.pipe()
+            h.spawn(task, sender, i)
+            recver.recv()
+    return _
+
+
+if __name__ == '__main__':
+    for _ in xrange(3):
+        for pool_size in (0, 100):
+            h = vanilla.Hub(pool_size=pool_size)
+            benchmark('spawn (pool_size=%s)' % pool_size, 100, spawn(h))
+            benchmark('pipe (pool_size=%s)' % pool_size, 100, pipe(h))
@@ -0,0 +1,71 @@
+import time
+
+import vanilla
+import vanilla.message
+
+
+CHUNK = 16384
+
+
+def body(h, size):
+    # a large body arriving as 16KB reads, consumed with a single recv_n
+    sender, recver = vanilla.message.Stream(h)
+    chunk = 'x' * CHUNK
+
+    @h.spawn
+    def _():
+        for i in xrange(size // CHUNK):
+            sender.send(chunk)
+
+    start = time.time()
+    got = recver.recv_n(size)
+    elapsed = time.time() - start
+    assert len(got) == size
+    print '%-30s %12.2f MB/s' % (
+        'recv_n %sMB' % (size >> 20), (size >> 20) / elapsed)
+
+
+def lines(h, chunks):
+    # many small lines packed into 16KB reads
+    sender, recver = vanilla.message.Stream(h)
+    line = 'x' * 63 + '\n'
+    chunk = line * (CHUNK // len(line))
+    n = chunks * (CHUNK // len(line))
+
+    @h.spawn
+    def _():
+        for i in xrange(chunks):
+            sender.send(chunk)
+
+    start = time.time()
+    for i in xrange(n):
+        recver.recv_line()
+    print '%-30s %12.2f' % ('recv_line', n / (time.time() - start))
+
+
+def trickle(h, size, step=64):
+    # a single large line arriving a few bytes at a time, like a slow client
+    # sending an oversized header block
+    sender, recver = vanilla.message.Stream(h, sep='\r\n')
+    chunk = 'x' * step
+
+    @h.spawn
+    def _():
+        for i in xrange(size // step):
+            sender.send(chunk)
+        sender.send('\r\n')
+
+    start = time.time()
+    got = recver.recv_line()
+    elapsed = time.time() - start
+    assert len(got) == size
+    print '%-30s %12.2f KB/s' % (
+        'trickle %sKB' % (size >> 10), (size >> 10) / elapsed)
+
+
+if __name__ == '__main__':
+    h = vanilla.Hub()
+    for _ in xrange(3):
+        body(h, 100 << 20)
+        lines(h, 400)
+        trickle(h, 1 << 20)
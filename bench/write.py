@@ -0,0 +1,32 @@
+import time
+
+import vanilla
+
+
+def small(h, n, size=100):
+    # *n* small sends on a single TCP connection, drained by the peer
+    server = h.tcp.listen()
+    client = h.tcp.connect(server.port)
+    conn = server.recv()
+    data = 'x' * size
+
+    @h.spawn
+    def _():
+        conn.recv_n(n * size)
+        conn.send('done')
+
+    start = time.time()
+    for i in xrange(n):
+        client.send(data)
+    client.recv()
+    print '%-30s %12.2f' % ('send %s bytes' % size, n / (time.time() - start))
+
+    client.close()
+    conn.close()
+    server.close()
+
+
+if __name__ == '__main__':
+    h = vanilla.Hub()
+    for _ in xrange(3):
+        small(h, 100000)
@@ -1,7 +1,13 @@
+import weakref
 import time
+import os
+import gc
+
+import pytest
 
 import vanilla
 import vanilla.core
+import vanilla.poll
 
 
 def test_lazy():
@@ -42,6 +48,69 @@ def test_Scheduler():
     assert not s
 
 
+def test_Scheduler_clock():
+    clock = [100.0]
+    s = vanilla.core.Scheduler(clock=lambda: clock[0])
+    s.add(10, 'f1')
+    assert abs(s.timeout() - 0.010) < 0.000001
+
+    clock[0] += 0.020
+    assert s.timeout() < 0
+    assert s.pop() == ('f1', ())
+
+
+def test_TimerWheel():
+    # a fixed clock, so the 1ms apart items can't share a tick
+    s = vanilla.core.TimerWheel(clock=lambda: 100.0)
+    s.add(4, 'f2')
+    s.add(9, 'f4')
+    s.add(3, 'f1')
+    item3 = s.add(7, 'f3')
+
+    assert abs(s.timeout() - 0.003) < 0.001
+    assert len(s) == 4
+
+    s.remove(item3)
+    assert abs(s.timeout() - 0.003) < 0.001
+    assert len(s) == 3
+
+    assert s.pop() == ('f1', ())
+    assert abs(s.timeout() - 0.004) < 0.001
+    assert len(s) == 2
+
+    assert s.pop() == ('f2', ())
+    assert abs(s.timeout() - 0.009) < 0.001
+    assert len(s) == 1
+
+    assert s.pop() == ('f4', ())
+    assert not s
+
+
+def test_TimerWheel_levels():
+    s = vanilla.core.TimerWheel()
+    # spread items across each of the wheel's levels
+    delays = [5, 300, 20000, 2000000, 200000000, 2**33]
+    items = [s.add(ms, ms) for ms in reversed(delays)]
+    assert sorted(item.level for item in items) == [0, 1, 2, 3, 4, 4]
+
+    s.remove(items[-1])
+    assert [s.pop()[0] for _ in xrange(len(s))] == delays[1:]
+    assert not s
+
+
+def test_TimerWheel_cascade():
+    s = vanilla.core.TimerWheel()
+    s.add(270, 'f2')
+    s.add(260, 'f1')
+    s.add(10, 'f0')
+    assert 0.010 - s.timeout() < 0.001
+
+    time.sleep(0.28)
+    assert s.timeout() < 0
+    assert [s.pop()[0] for _ in xrange(len(s))] == ['f0', 'f1', 'f2']
+    assert all(not x for x in s.occupied)
+
+
 class TestHub(object):
     def test_spawn(self):
         h = vanilla.Hub()
@@ -69,6 +138,97 @@ class TestHub(object):
         h.sleep(1)
         assert a == [2]
 
+    def test_now(self):
+        h = vanilla.Hub()
+        start = h.now()
+        # the clock is only read once per iteration of the loop
+        time.sleep(0.01)
+        assert h.now() == start
+
+        h.sleep(10)
+        assert h.now() - start >= 0.01
+
+    def test_dispatch(self):
+        h = vanilla.Hub()
+        r, w = os.pipe()
+        pollin = h.register(r, vanilla.poll.POLLIN)
+
+        h.spawn(os.write, w, '1')
+        assert pollin.recv() is True
+        assert os.read(r, 4096) == '1'
+
+        # errors are dispatched on a green thread, and close the registration
+        os.close(w)
+        pytest.raises(vanilla.Halt, pollin.recv)
+        h.unregister(r)
+        os.close(r)
+        assert not h.registered
+
+    def test_timer_wheel(self):
+        h = vanilla.Hub(scheduler=vanilla.core.TimerWheel)
+        a = []
+
+        h.spawn_later(10, lambda: a.append(1))
+        h.spawn(lambda: a.append(2))
+
+        h.sleep(1)
+        assert a == [2]
+
+        h.sleep(10)
+        assert a == [2, 1]
+
+        p = h.pipe()
+        pytest.raises(vanilla.Timeout, p.recv, timeout=5)
+        assert not h.scheduled
+
+    def test_pool(self):
+        h = vanilla.Hub(pool_size=2)
+        a = []
+
+        def raiser():
+            raise Exception()
+
+        for i in xrange(3):
+            h.spawn(a.append, i)
+        h.spawn(raiser)
+        h.spawn(a.append, 3)
+        h.sleep(1)
+        assert a == [0, 1, 2, 3]
+        # callables ready back to back are run on the same green thread
+        assert (h.pool_misses, h.pool_hits) == (1, 4)
+        assert len(h.pool) == 1
+
+        # green threads which pause are replaced, up to pool_size
+        p1, p2 = h.pipe(), h.pipe()
+        h.spawn(p1.recv)
+        h.spawn(p2.recv)
+        h.sleep(1)
+        assert (h.pool_misses, h.pool_hits) == (2, 5)
+        assert len(h.pool) == 0
+        p1.send(1)
+        p2.send(2)
+        h.sleep(1)
+        assert len(h.pool) == 2
+
+    def test_pool_abandoned(self):
+        h = vanilla.Hub(pool_size=2)
+        sender, recver = h.pipe()
+        ref = weakref.ref(recver)
+
+        def consume(recver):
+            for _ in recver:
+                pass
+
+        h.spawn(consume, recver)
+        del recver
+        h.sleep(1)
+
+        # once the callable is done, the worker doesn't keep the recver alive
+        del sender
+        gc.collect()
+        h.sleep(1)
+        assert ref() is None
+
     def test_stop(self):
         h = vanilla.Hub()
 
@@ -1,5 +1,7 @@
 import json
+import ssl
 import gc
+import os
 
 import pytest
 
@@ -97,10 +99,7 @@ class TestHTTP(object):
         assert response.consume() == 'toby'
         h.stop()
 
-    @pytest.mark.skipif(True, reason='TODO')
     def test_post_chunked(self):
-        print
-        print
         h = vanilla.Hub()
 
         serve = h.http.listen()
@@ -128,11 +127,211 @@ class TestHTTP(object):
             sender.close()
 
         response = conn.post('/', data=recver).recv()
+        assert response.consume() == '012'
+
+        # any iterable can be streamed, as is if its length is given
+        response = conn.post('/', data=iter(['foo', '', 'bar'])).recv()
+        assert response.consume() == 'foobar'
+        response = conn.post(
+            '/', headers={'content-length': 6}, data=['foo', 'bar']).recv()
+        assert response.consume() == 'foobar'
+        h.stop()
+
+    def test_post_backpressure(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen(threshold=0)
+        stall = h.state()
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                stall.recv()
+                request.reply(
+                    vanilla.http.Status(200), {},
+                    str(len(request.consume())))
+
+        uri = 'http://localhost:%s' % serve.port
+        conn = h.http.connect(uri)
+
+        n, size = 200, 65536
+        taken = []
+
+        def body():
+            for i in xrange(n):
+                taken.append(i)
+                yield 'x' * size
+
+        response = conn.post('/', data=body())
+        h.sleep(50)
+        # the upload is held up by the stalled server, rather than the body
+        # being read ahead into memory
+        assert 0 < len(taken) < n
+        stall.send(True)
+        assert response.recv().consume() == str(n * size)
+        assert len(taken) == n
+        h.stop()
+
+    def test_post_source_fails(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        @serve.consume
+        def _(conn):
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.consume())
+
+        def source():
+            yield 'foo'
+            raise Exception('source failed')
+
+        conn = h.http.connect('http://localhost:%s' % serve.port)
+        response = conn.post('/', data=source())
+        # the request fails, rather than its body being cut short
+        pytest.raises(vanilla.ConnectionLost, response.recv)
+        h.stop()
+
+    def test_request_body_stream(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen(threshold=10)
+        bodies = h.queue(10)
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                if request.path == '/skip':
+                    # an unread body is skipped over
+                    bodies.send(type(request.body))
+                else:
+                    bodies.send(request.body)
+                    if hasattr(request.body, 'recv'):
+                        bodies.send(request.body.recv())
+                        bodies.send(request.consume())
+                request.reply(vanilla.http.Status(200), {}, request.path)
 
-        for data in response.body:
-            print data
+        client = h.tcp.connect(serve.port)
+        # under the threshold, the body is read up front
+        client.send('POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello')
+        assert bodies.recv() == 'hello'
+
+        # over it, the request is received before its body
+        client.send('POST / HTTP/1.1\r\nContent-Length: 20\r\n\r\n')
+        client.send('x' * 8)
+        body = bodies.recv()
+        assert hasattr(body, 'recv')
+        assert bodies.recv() == 'x' * 8
+        client.send('y' * 12)
+        assert bodies.recv() == 'y' * 12
+
+        client.send('POST /skip HTTP/1.1\r\nContent-Length: 20\r\n\r\n')
+        client.send('z' * 20 + 'GET /next HTTP/1.1\r\n\r\n')
+        assert bodies.recv() is vanilla.message.Recver
+        assert bodies.recv() == ''
+        h.stop()
+
+    def test_request_body_chunked(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen(threshold=10)
+        bodies = h.queue(10)
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                bodies.send(request.body)
+                if hasattr(request.body, 'recv'):
+                    bodies.send(list(request.body))
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        client = h.tcp.connect(serve.port)
+        headers = 'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
 
-        # h.stop()
+        client.send(headers + '3\r\nfoo\r\n3;x=y\r\nbar\r\n0\r\n\r\n')
+        assert bodies.recv() == 'foobar'
+
+        # once the threshold is passed, the body's streamed
+        client.send(headers + '6\r\nfoobar\r\n6\r\nfoobar\r\n')
+        body = bodies.recv()
+        assert hasattr(body, 'recv')
+        client.send('3\r\nbaz\r\n0\r\nX-Trailer: 1\r\n\r\n')
+        assert ''.join(bodies.recv()) == 'foobarfoobarbaz'
+        h.stop()
+
+    def test_invalid_length(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        def handle(conn):
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.consume())
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        for request in [
+                'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\nxyz',
+                'POST / HTTP/1.1\r\nContent-Length: 0x3\r\n\r\nxyz',
+                'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                '-5\r\nxyz\r\n0\r\n\r\n', ]:
+            client = h.tcp.connect(serve.port)
+            client.send(request)
+            # the connection is dropped, rather than the hub hanging
+            assert ''.join(client.recver) == ''
+
+        conn = h.http.connect('http://localhost:%s' % serve.port)
+        assert conn.post('/', data='ok').recv().consume() == 'ok'
+        h.stop()
+
+    def test_stream_malformed_chunk(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen(threshold=10)
+        check = h.pipe()
+
+        @serve.consume
+        def _(conn):
+            for request in conn:
+                try:
+                    check.send(request.consume())
+                except vanilla.ConnectionLost, e:
+                    check.send(e)
+                break
+
+        client = h.tcp.connect(serve.port)
+        client.send(
+            'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+            '6\r\nfoobar\r\n6\r\nfoobar\r\nzz\r\nfoobar\r\n0\r\n\r\n')
+        # the body fails, rather than being cut short
+        pytest.raises(vanilla.ConnectionLost, check.recv)
+        h.stop()
+
+    def test_expect_continue(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                request.reply(
+                    vanilla.http.Status(200), {}, request.consume())
+
+        client = h.tcp.connect(serve.port)
+        client.send(
+            'POST / HTTP/1.1\r\nContent-Length: 5\r\n'
+            'Expect: 100-continue\r\n\r\n')
+        assert client.recv_partition('\r\n\r\n') == 'HTTP/1.1 100 CONTINUE'
+        client.send('hello')
+        assert client.recv_partition('\r\n').startswith('HTTP/1.1 200')
+        assert client.recv_partition('\r\n\r\n')
+        assert client.recv_n(5) == 'hello'
+        h.stop()
 
     def test_post_form_encoded(self):
         h = vanilla.Hub()
@@ -244,6 +443,198 @@ class TestHTTP(object):
         assert q.recv() == 20
         h.stop()
 
+    def test_pipeline(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+        # requests seen by the server before it's replied to any
+        seen = []
+
+        def reply(request):
+            request.reply(vanilla.http.Status(200), {}, request.path)
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                seen.append(request.path)
+                h.spawn_later(10, reply, request)
+
+        uri = 'http://localhost:%s' % serve.port
+        conn = h.http.connect(uri, depth=2)
+
+        responses = []
+
+        @h.spawn
+        def _():
+            for i in xrange(5):
+                responses.append(conn.get('/%s' % i))
+
+        h.sleep(5)
+        # the second request was written before the first was answered, but
+        # the rest wait for room in the pipeline
+        assert seen == ['/0', '/1']
+        assert len(responses) == 2
+        assert len(conn.inflight) == 2
+
+        h.sleep(100)
+        assert [r.recv().consume() for r in responses] == \
+            ['/%s' % i for i in xrange(5)]
+        assert not conn.inflight
+        h.stop()
+
+    def test_request_timeout(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+        conns = []
+
+        @serve.consume
+        def _(conn):
+            conns.append(conn)
+
+            @h.spawn
+            def _():
+                for request in conn:
+                    if request.path == '/slow':
+                        # stalls the rest of this connection's responses too
+                        h.sleep(1000)
+                    request.reply(vanilla.http.Status(200), {}, request.path)
+
+        uri = 'http://localhost:%s' % serve.port
+        conn = h.http.connect(uri, reconnect=True)
+
+        slow = conn.get('/slow', timeout=20)
+        fast = conn.get('/fast')
+        pytest.raises(vanilla.Timeout, slow.recv)
+        # the request pipelined behind is retried on a new connection
+        assert fast.recv().consume() == '/fast'
+        assert len(conns) == 2
+
+        # the deadline covers waiting for room in the pipeline, behind a
+        # request without one
+        conn = h.http.connect(uri, depth=1)
+        slow = conn.get('/slow')
+        start = h.now()
+        pytest.raises(vanilla.Timeout, conn.get('/x', timeout=20).recv)
+        assert h.now() - start < 0.5
+        conn.close()
+
+        # the default deadline applies to each request
+        conn = h.http.connect(uri, timeout=20)
+        pytest.raises(vanilla.Timeout, conn.get('/slow').recv)
+        # and without reconnect, the connection stays lost
+        pytest.raises(vanilla.ConnectionLost, conn.get('/fast').recv)
+        h.stop()
+
+    def test_upload_lost(self):
+        h = vanilla.Hub()
+
+        server = h.tcp.listen()
+
+        @server.consume
+        def _(conn):
+            @h.spawn
+            def _():
+                head = conn.recv_partition('\r\n\r\n')
+                if head.startswith('GET /stall '):
+                    # never read any further
+                    h.sleep(10000)
+                # read a little of the upload and then drop the connection
+                conn.recv()
+                conn.close()
+
+        uri = 'http://localhost:%s' % server.port
+        body = 'x' * (10 * 1024 * 1024)
+
+        # the server closes part way through a large body
+        conn = h.http.connect(uri)
+        response = conn.post('/', data=body)
+        pytest.raises(vanilla.ConnectionLost, response.recv)
+
+        # a request stuck being written still misses its deadline
+        conn = h.http.connect(uri)
+        response = conn.request('GET', '/stall', data=body, timeout=100)
+        pytest.raises(vanilla.Timeout, response.recv)
+        h.stop()
+
+    def test_reconnect(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+        conns = []
+
+        @serve.consume
+        def _(conn):
+            conns.append(conn)
+
+            @h.spawn
+            def _():
+                # each connection only answers one request
+                request = conn.recv()
+                request.reply(vanilla.http.Status(200), {}, request.path)
+                h.sleep(10)
+                conn.socket.close()
+
+        uri = 'http://localhost:%s' % serve.port
+
+        conn = h.http.connect(uri)
+        responses = [conn.get('/a'), conn.get('/b'), conn.post('/c')]
+        assert responses[0].recv().consume() == '/a'
+        for response in responses[1:]:
+            pytest.raises(vanilla.ConnectionLost, response.recv)
+
+        conn = h.http.connect(uri, reconnect=True)
+        responses = [conn.get('/a'), conn.get('/b'), conn.get('/c')]
+        assert [r.recv().consume() for r in responses] == ['/a', '/b', '/c']
+        # a post which was written isn't sent again
+        responses = [conn.get('/d'), conn.post('/e')]
+        assert responses[0].recv().consume() == '/d'
+        pytest.raises(vanilla.ConnectionLost, responses[1].recv)
+        # but the connection's reestablished for the next request
+        assert conn.get('/f').recv().consume() == '/f'
+        h.stop()
+
+    def test_reconnect_concurrent(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+        conns = []
+
+        def handle(conn):
+            conns.append(conn)
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        conn = h.http.connect(
+            'http://localhost:%s' % serve.port, reconnect=True)
+        assert conn.get('/').recv().consume() == '/'
+        lost = conn.socket
+
+        # the server drops the idle connection, and a number of requests
+        # are made at once
+        conns[0].socket.close()
+        h.sleep(10)
+        results = h.queue(10)
+        for i in xrange(4):
+            h.spawn(
+                lambda i: results.send(conn.get('/%s' % i).recv().consume()),
+                i)
+        assert sorted(results.recv() for i in xrange(4)) == \
+            ['/0', '/1', '/2', '/3']
+
+        # they share a single new connection, and nothing is left open
+        # besides it
+        assert len(conns) == 2
+        assert lost.recver.halted
+        conn.close()
+        h.sleep(10)
+        # just the listener is still registered with the poller
+        assert len(h.registered) == 1
+        h.stop()
+
     def test_basic_auth(self):
         h = vanilla.Hub()
 
@@ -283,6 +674,375 @@ class TestHTTP(object):
         pytest.raises(vanilla.ConnectionLost, response.recv)
         h.stop()
 
+    def test_line_too_long(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            conn.socket.recver.max_length = 100
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        uri = 'http://localhost:%s' % serve.port
+        conn = h.http.connect(uri)
+
+        response = conn.get('/', headers={'X-Long': 'x' * 200})
+        pytest.raises(vanilla.ConnectionLost, response.recv)
+        h.stop()
+
+    def test_parse_head(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                request.reply(
+                    vanilla.http.Status(200),
+                    {},
+                    json.dumps([
+                        request.method,
+                        request.path,
+                        request.headers['host'],
+                        request.headers['X-Tight'],
+                        request.headers.get('x-padded'),
+                        request.headers.get('X-Empty'), ]))
+
+        client = h.tcp.connect(serve.port)
+        # stray line endings ahead of the request, no space after a colon and
+        # padding around a value
+        client.send(
+            '\r\nGET /parse HTTP/1.1\r\n'
+            'Host:localhost\r\n'
+            'X-Tight:1\r\n'
+            'X-Padded: \t 2 \t\r\n'
+            'X-Empty:\r\n\r\n')
+        head = client.recv_partition('\r\n\r\n')
+        assert head.startswith('HTTP/1.1 200 OK\r\n')
+        headers = vanilla.http.parse_headers(head, head.find('\r\n') + 2)
+        body = client.recv_n(int(headers['Content-Length']))
+        assert json.loads(body) == [
+            'GET', '/parse', 'localhost', '1', '2', '']
+        h.stop()
+
+    def test_parse_headers(self):
+        headers = vanilla.http.parse_headers(
+            'X: 1\r\nContent-Length:2\r\nx:3')
+        assert headers['x'] == '3'
+        assert headers['content-length'] == '2'
+        pytest.raises(
+            ValueError, vanilla.http.parse_headers, 'X 1\r\nY: 2')
+        pytest.raises(
+            ValueError, vanilla.http.parse_headers, 'X: 1\r\n folded')
+        pytest.raises(
+            vanilla.exception.Overflow,
+            vanilla.http.parse_headers, 'X: 1\r\nY: 2', limit=1)
+
+    def test_too_many_headers(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        uri = 'http://localhost:%s' % serve.port
+        conn = h.http.connect(uri)
+
+        headers = dict(('X-%s' % i, str(i)) for i in xrange(200))
+        response = conn.get('/', headers=headers)
+        pytest.raises(vanilla.ConnectionLost, response.recv)
+        h.stop()
+
+    def test_response_head(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                if request.path == '/custom':
+                    status = (299, 'FINE')
+                else:
+                    status = vanilla.http.Status(200)
+                request.reply(status, {}, request.path)
+
+        uri = 'http://localhost:%s' % serve.port
+        conn = h.http.connect(uri)
+
+        one = conn.get('/').recv()
+        assert one.consume() == '/'
+        two = conn.get('/custom').recv()
+        assert two.consume() == '/custom'
+        assert one.status == ('HTTP/1.1', 200, 'OK')
+        assert two.status == ('HTTP/1.1', 299, 'FINE')
+        # the Date header is cached between responses
+        assert one.headers['Date'] == h.http.date()
+        assert two.headers['Date'] == one.headers['Date']
+        # and refreshed once the interval has passed
+        h.sleep(1100)
+        three = conn.get('/').recv()
+        assert three.consume() == '/'
+        assert three.headers['Date'] == h.http.date()
+        assert three.headers['Date'] != one.headers['Date']
+        h.stop()
+        # the refresh greenlet exits with the hub
+        assert h.http._date is None
+
+    def test_connection_close(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        def handle(conn):
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        # HTTP/1.1 closes when asked to
+        client = h.tcp.connect(serve.port)
+        client.send(
+            'GET /1 HTTP/1.1\r\n\r\n'
+            'GET /2 HTTP/1.1\r\nConnection: close\r\n\r\n'
+            'GET /3 HTTP/1.1\r\n\r\n')
+        got = ''.join(client.recver)
+        assert got.count('HTTP/1.1 200 OK') == 2
+        assert 'Connection: close' in got
+        assert got.endswith('/2')
+
+        # HTTP/1.0 closes unless asked to keep alive
+        client = h.tcp.connect(serve.port)
+        client.send(
+            'GET /1 HTTP/1.0\r\nConnection: keep-alive\r\n\r\n'
+            'GET /2 HTTP/1.0\r\n\r\n'
+            'GET /3 HTTP/1.0\r\n\r\n')
+        got = ''.join(client.recver)
+        assert got.count('HTTP/1.1 200 OK') == 2
+        assert 'Connection: keep-alive' in got
+        assert got.endswith('/2')
+        h.stop()
+
+    def test_max_requests(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen(max_requests=2)
+
+        def handle(conn):
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        conn = h.http.connect('http://localhost:%s' % serve.port)
+        assert conn.get('/1').recv().consume() == '/1'
+        response = conn.get('/2').recv()
+        assert response.headers['Connection'] == 'close'
+        assert response.consume() == '/2'
+        assert not conn.reusable()
+        h.stop()
+
+    def test_idle_timeout(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen(idle_timeout=20, header_timeout=20)
+
+        def handle(conn):
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        # idle between requests
+        conn = h.http.connect('http://localhost:%s' % serve.port)
+        assert conn.get('/').recv().consume() == '/'
+        h.sleep(50)
+        assert conn.socket.recver.halted
+
+        # a head which never finishes arriving
+        client = h.tcp.connect(serve.port)
+        client.send('GET / HTTP/1.1\r\n')
+        h.sleep(10)
+        client.send('Host: localhost\r\n')
+        assert ''.join(client.recver) == ''
+        h.stop()
+
+    def test_max_connections(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen(max_connections=2)
+
+        def handle(conn):
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        uri = 'http://localhost:%s' % serve.port
+        one = h.http.connect(uri)
+        two = h.http.connect(uri)
+        assert one.get('/').recv().consume() == '/'
+        h.sleep(10)
+        assert two.get('/').recv().consume() == '/'
+
+        # the connection idle the longest is evicted to make room
+        three = h.http.connect(uri)
+        assert three.get('/').recv().consume() == '/'
+        assert one.socket.recver.halted
+        assert not two.socket.recver.halted
+        assert len(serve.connections) == 2
+
+        # with none idle, a new connection is refused
+        stalled = [h.tcp.connect(serve.port) for i in xrange(2)]
+        for client in stalled:
+            client.send('GET / HTTP/1.1\r\n')
+        h.sleep(10)
+        client = h.tcp.connect(serve.port)
+        assert ''.join(client.recver) == ''
+        assert len(serve.connections) == 2
+        h.stop()
+
+    def test_https(self):
+        h = vanilla.Hub()
+
+        cert = os.path.join(os.path.dirname(__file__), 'cert.pem')
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(cert)
+        serve = h.http.listen(tls=context)
+
+        @h.spawn
+        def _():
+            conn = serve.recv()
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        uri = 'https://localhost:%s' % serve.port
+        conn = h.http.connect(
+            uri, tls=ssl.create_default_context(cafile=cert))
+        assert conn.get('/').recv().consume() == '/'
+        assert conn.get('/toby').recv().consume() == '/toby'
+        h.stop()
+
+    def test_pool(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+        conns = []
+
+        @serve.consume
+        def _(conn):
+            conns.append(conn)
+
+            @h.spawn
+            def _():
+                for request in conn:
+                    request.reply(vanilla.http.Status(200), {}, request.path)
+
+        uri = 'http://localhost:%s' % serve.port
+        for path in ['/a', '/b', '/c']:
+            response = h.http.get(uri + path).recv()
+            assert response.consume() == path
+        # a single connection is reused
+        assert len(conns) == 1
+        pool = h.http.pool(uri)
+        assert (pool.created, pool.reused) == (1, 2)
+
+        # the server drops the idle connection
+        conns[0].socket.close()
+        h.sleep(10)
+        assert h.http.post(uri + '/d').recv().consume() == '/d'
+        assert len(conns) == 2
+
+        # concurrent requests use as many connections as max_active allows
+        pool.max_active = 2
+        responses = [pool.get('/%s' % i) for i in xrange(4)]
+        assert [r.recv().consume() for r in responses] == \
+            ['/%s' % i for i in xrange(4)]
+        assert len(conns) == 3
+        h.sleep(1)
+        assert pool.active == 0
+        assert len(pool.idle) == 2
+
+        # idle connections time out
+        pool = vanilla.http.Pool(h, uri, idle_timeout=10)
+        pool.get('/').recv().consume()
+        h.sleep(1)
+        assert len(pool.idle) == 1
+        h.sleep(20)
+        assert len(pool.idle) == 0
+
+        # the sweeper stops quietly along with the hub
+        pool.get('/').recv().consume()
+        h.sleep(1)
+        assert pool.sweeping
+        h.stop()
+        assert not pool.sweeping
+
+    def test_pool_abandoned_body(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+
+        def handle(conn):
+            for request in conn:
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        pool = vanilla.http.Pool(
+            h, 'http://localhost:%s' % serve.port, max_active=1)
+        # a response whose body is dropped without being read
+        pool.get('/dropped').recv()
+        gc.collect()
+        h.sleep(10)
+        # still gives its connection slot back
+        assert pool.active == 0
+        assert pool.get('/next').recv().consume() == '/next'
+        h.stop()
+
+    def test_pool_no_replay(self):
+        h = vanilla.Hub()
+
+        serve = h.http.listen()
+        posts = []
+
+        def handle(conn):
+            for request in conn:
+                if request.method in ('POST', 'PUT'):
+                    # the request is read, and then the connection drops
+                    posts.append(request.consume())
+                    conn.socket.close()
+                    break
+                request.reply(vanilla.http.Status(200), {}, request.path)
+
+        serve.consume(lambda conn: h.spawn(handle, conn))
+
+        uri = 'http://localhost:%s' % serve.port
+        pool = vanilla.http.Pool(h, uri)
+        assert pool.get('/').recv().consume() == '/'
+        # a POST which was written on a reused connection isn't sent again
+        response = pool.post('/', data='debit')
+        pytest.raises(vanilla.ConnectionLost, response.recv)
+        assert posts == ['debit']
+
+        # nor is a streamed body, even for an idempotent method
+        assert pool.get('/').recv().consume() == '/'
+        response = pool.request('PUT', '/', data=iter(['cre', 'dit']))
+        pytest.raises(vanilla.ConnectionLost, response.recv)
+        assert posts == ['debit', 'credit']
+        assert pool.retries == 0
+        h.stop()
+
     def test_json(self):
         h = vanilla.Hub()
         serve = h.http.listen()
@@ -61,6 +61,25 @@ class TestIO(object):
             got += recver.recv()
         assert got == want1+want2
 
+    def test_write_queue(self):
+        h = vanilla.Hub()
+        sender, recver = h.io.pipe()
+
+        want = [c * 1024 * 1024 for c in 'abc']
+        for data in want:
+            h.spawn(sender.send, data)
+
+        got = ''
+        while len(got) < 3 * 1024 * 1024:
+            got += recver.recv()
+        assert got == ''.join(want)
+        assert not sender.writing
+        assert not sender.waiting
+
+        # uncontended writes don't need to wait on the hub
+        sender.send('123')
+        assert recver.recv() == '123'
+
     def test_write_close(self):
         h = vanilla.Hub()
         sender, recver = h.io.pipe()
@@ -114,3 +133,46 @@ class TestIO(object):
         pytest.raises(vanilla.Closed, recver.recv)
         h.sleep(1)
         assert not h.registered
+
+    def test_read_into(self):
+        h = vanilla.Hub()
+        sender, recver = h.io.pipe(size=4, into=True)
+
+        h.spawn(sender.send, '12foo\nbar')
+        assert recver.recv_n(2) == '12'
+        assert recver.recv_line() == 'foo'
+        # reads are 4 bytes at a time; what's left of the second is buffered
+        assert recver.recv() == 'ba'
+        got = recver.recv()
+        assert type(got) is str
+        assert got == 'r'
+
+        sender.close()
+        pytest.raises(vanilla.Closed, recver.recv)
+
+    def test_cork(self):
+        h = vanilla.Hub()
+        sender, recver = h.io.pipe()
+
+        writes = []
+        write = sender.fd.write
+
+        def _(data):
+            writes.append(data)
+            return write(data)
+        sender.fd.write = _
+
+        sender.cork()
+        sender.send('foo')
+        sender.send('bar')
+        pytest.raises(vanilla.Timeout, recver.recv, timeout=10)
+        assert writes == []
+
+        sender.flush()
+        assert writes == ['foobar']
+        assert recver.recv() == 'foobar'
+
+        # uncorked sends are written as they come
+        sender.send('baz')
+        assert writes == ['foobar', 'baz']
+        assert recver.recv() == 'baz'
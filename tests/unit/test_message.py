@@ -238,6 +238,17 @@ class TestPipe(object):
         h.spawn(p1.send, 1)
         assert p2.recv() == 1
 
+    def test_slots(self):
+        h = vanilla.Hub()
+        sender, recver = h.pipe().pipe(lambda up, down: None)
+
+        assert not hasattr(sender.middle, '__dict__')
+        # ends don't allocate a dict unless an extra attribute is set
+        for end in (sender, recver, recver.middle.sender()):
+            assert dict not in [type(x) for x in gc.get_referents(end)]
+        recver.port = 8000
+        assert recver.port == 8000
+
     def test_pipe_to_function(self):
         h = vanilla.Hub()
 
@@ -723,8 +734,7 @@ class TestStream(object):
     def test_stream(self):
         h = vanilla.Hub()
 
-        sender, recver = h.pipe()
-        recver = vanilla.message.Stream(recver)
+        sender, recver = vanilla.message.Stream(h)
 
         @h.spawn
         def _():
@@ -745,3 +755,58 @@ class TestStream(object):
         assert recver.recv_line() == 'bar'
         assert recver.recv() == 'end.'
         pytest.raises(vanilla.Closed, recver.recv_n, 2)
+
+    def test_stream_view(self):
+        h = vanilla.Hub()
+        sender, recver = vanilla.message.Stream(h)
+
+        @h.spawn
+        def _():
+            sender.send('foo')
+            sender.send('bar\n')
+            sender.send('baz')
+            sender.close()
+
+        view = recver.recv_view(4)
+        assert isinstance(view, memoryview)
+        assert view.tobytes() == 'foob'
+        assert recver.buffered() == 3
+        # the buffer can still grow while the view is held
+        assert recver.recv_line() == 'ar'
+        assert recver.recv_n(3) == 'baz'
+        assert view.tobytes() == 'foob'
+        assert recver.buffered() == 0
+        pytest.raises(vanilla.Closed, recver.recv_view, 1)
+
+    def test_stream_partition_split(self):
+        h = vanilla.Hub()
+        sender, recver = vanilla.message.Stream(h)
+
+        @h.spawn
+        def _():
+            # the seperator arrives split across chunks
+            for chunk in ['foo\r', '\nbar', '\r', '\n']:
+                sender.send(chunk)
+            sender.close()
+
+        assert recver.recv_partition('\r\n') == 'foo'
+        assert recver.recv_partition('\r\n') == 'bar'
+        pytest.raises(vanilla.Closed, recver.recv_partition, '\r\n')
+
+    def test_stream_max_length(self):
+        h = vanilla.Hub()
+        sender, recver = vanilla.message.Stream(h, max_length=4)
+
+        @h.spawn
+        def _():
+            sender.send('foo\n12')
+            sender.send('3')
+            sender.send('45')
+            sender.send('6\n')
+
+        assert recver.recv_line() == 'foo'
+        pytest.raises(vanilla.Overflow, recver.recv_line)
+        # the data is still available to the caller
+        assert recver.recv_n(5) == '12345'
+        recver.max_length = None
+        assert recver.recv_line() == '6'
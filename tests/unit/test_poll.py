@@ -1,8 +1,35 @@
+import socket
+import errno
 import os
 
+import pytest
+
+import vanilla
+import vanilla.io
 import vanilla.poll
 
 
+def drain(fd):
+    # reads from a non-blocking fd until EAGAIN
+    got = ''
+    while True:
+        try:
+            got += os.read(fd, 65536)
+        except OSError, e:
+            assert e.errno == errno.EAGAIN
+            return got
+
+
+def fill(sock):
+    # writes to a non-blocking socket until EAGAIN
+    while True:
+        try:
+            sock.send('x' * 65536)
+        except socket.error, e:
+            assert e.errno == errno.EAGAIN
+            return
+
+
 class TestPoll(object):
     def test_poll(self):
         poll = vanilla.poll.Poll()
@@ -57,3 +84,224 @@ class TestPoll(object):
         got = poll.poll()
         assert got == [(w, vanilla.poll.POLLOUT), (w, vanilla.poll.POLLERR)]
         assert poll.poll(timeout=0) == []
+
+    def test_level(self):
+        poll = vanilla.poll.Poll()
+        r, w = os.pipe()
+
+        poll.register(r, vanilla.poll.POLLIN, mode=vanilla.poll.LEVEL)
+        assert poll.poll(timeout=0) == []
+
+        os.write(w, '1')
+        # reported for as long as there's data to read
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+        assert poll.poll(timeout=0) == [(r, vanilla.poll.POLLIN)]
+
+        assert os.read(r, 4096) == '1'
+        assert poll.poll(timeout=0) == []
+
+    def test_oneshot(self):
+        poll = vanilla.poll.Poll()
+        r, w = os.pipe()
+
+        poll.register(r, vanilla.poll.POLLIN, mode=vanilla.poll.ONESHOT)
+        os.write(w, '1')
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+        # disarmed until modified, even with new data
+        os.write(w, '2')
+        assert poll.poll(timeout=0) == []
+
+        poll.modify(r, vanilla.poll.POLLIN, mode=vanilla.poll.ONESHOT)
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+        assert poll.poll(timeout=0) == []
+        assert os.read(r, 4096) == '12'
+
+    def test_modify(self):
+        poll = vanilla.poll.Poll()
+        a, b = socket.socketpair()
+
+        poll.register(a.fileno(), vanilla.poll.POLLIN)
+        assert poll.poll(timeout=0) == []
+
+        # add interest in writes, without an unregister
+        poll.modify(a.fileno(), vanilla.poll.POLLIN, vanilla.poll.POLLOUT)
+        assert poll.poll() == [(a.fileno(), vanilla.poll.POLLOUT)]
+
+        poll.modify(a.fileno(), vanilla.poll.POLLIN)
+        b.send('1')
+        assert poll.poll() == [(a.fileno(), vanilla.poll.POLLIN)]
+        assert poll.poll(timeout=0) == []
+
+    def test_maxevents(self):
+        poll = vanilla.poll.Poll(maxevents=1)
+        pipes = [os.pipe() for _ in xrange(3)]
+        for r, w in pipes:
+            poll.register(r, vanilla.poll.POLLIN)
+            os.write(w, '1')
+
+        got = []
+        for _ in xrange(3):
+            events = poll.poll()
+            assert len(events) == 1
+            got.extend(events)
+        assert sorted(got) == sorted(
+            (r, vanilla.poll.POLLIN) for r, w in pipes)
+        assert poll.poll(timeout=0) == []
+
+    def test_batched(self):
+        poll = vanilla.poll.Poll()
+        r, w = os.pipe()
+
+        # changes which cancel out never reach the kernel
+        poll.register(r, vanilla.poll.POLLIN)
+        poll.unregister(r)
+        assert poll.poll(timeout=0) == []
+        assert poll.ctls == 0
+
+        poll.register(r, vanilla.poll.POLLIN)
+        poll.register(w, vanilla.poll.POLLOUT)
+        assert poll.poll() == [(w, vanilla.poll.POLLOUT)]
+        assert poll.ctls == 2
+
+        # neither does registering an fd again with the same interest
+        poll.register(r, vanilla.poll.POLLIN)
+        os.write(w, '1')
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+        assert poll.ctls == 2
+        assert poll.polls == 3
+        assert poll.skipped == 2
+
+    def test_closed(self):
+        poll = vanilla.poll.Poll()
+        r, w = os.pipe()
+
+        poll.register(r, vanilla.poll.POLLIN)
+        assert poll.poll(timeout=0) == []
+
+        # an fd number reused after a close is registered again
+        poll.unregister(r)
+        os.close(r)
+        os.close(w)
+        r, w = os.pipe()
+        poll.register(r, vanilla.poll.POLLIN)
+        os.write(w, '1')
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+
+        # an fd closed before it could be registered errors
+        r2, w2 = os.pipe()
+        poll.register(r2, vanilla.poll.POLLIN)
+        os.close(r2)
+        assert poll.poll() == [(r2, vanilla.poll.POLLERR)]
+
+
+@pytest.fixture(params=list(vanilla.poll.backends))
+def backend(request):
+    return vanilla.poll.backends[request.param]
+
+
+class TestBackends(object):
+    """
+    The behaviour the hub relies on, for each backend available here
+    """
+    def test_read(self, backend):
+        poll = backend()
+        r, w = os.pipe()
+        vanilla.io.unblock(r)
+
+        poll.register(r, vanilla.poll.POLLIN)
+        assert poll.poll(timeout=0) == []
+
+        os.write(w, '1')
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+        assert poll.poll(timeout=0) == []
+
+        # reported again once drained and rearmed
+        assert drain(r) == '1'
+        poll.rearm(r, vanilla.poll.POLLIN)
+        assert poll.poll(timeout=0) == []
+        os.write(w, '2')
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+
+    def test_write(self, backend):
+        poll = backend()
+        a, b = socket.socketpair()
+        a.setblocking(0)
+
+        poll.register(a.fileno(), vanilla.poll.POLLOUT)
+        assert poll.poll() == [(a.fileno(), vanilla.poll.POLLOUT)]
+        # a socket that stays writable isn't reported again
+        assert poll.poll(timeout=0) == []
+
+        # fill the socket's buffer until EAGAIN
+        fill(a)
+        poll.rearm(a.fileno(), vanilla.poll.POLLOUT)
+        assert poll.poll(timeout=0) == []
+
+        b.setblocking(0)
+        drain(b.fileno())
+        assert poll.poll() == [(a.fileno(), vanilla.poll.POLLOUT)]
+
+    def test_close(self, backend):
+        poll = backend()
+        r, w = os.pipe()
+
+        poll.register(r, vanilla.poll.POLLIN)
+        assert poll.poll(timeout=0) == []
+        os.close(w)
+        # select can only report a closed peer as readable
+        assert poll.poll() in (
+            [(r, vanilla.poll.POLLIN)],
+            [(r, vanilla.poll.POLLERR)],
+            [(r, vanilla.poll.POLLIN), (r, vanilla.poll.POLLERR)])
+        assert poll.poll(timeout=0) == []
+
+    def test_unregister(self, backend):
+        poll = backend()
+        r, w = os.pipe()
+
+        poll.register(r, vanilla.poll.POLLIN)
+        os.write(w, '1')
+        poll.unregister(r)
+        assert poll.poll(timeout=0) == []
+
+    def test_modes(self, backend):
+        poll = backend()
+        r, w = os.pipe()
+        os.write(w, '1')
+
+        poll.register(r, vanilla.poll.POLLIN, mode=vanilla.poll.LEVEL)
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+        assert poll.poll(timeout=0) == [(r, vanilla.poll.POLLIN)]
+
+        poll.modify(r, vanilla.poll.POLLIN, mode=vanilla.poll.ONESHOT)
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+        poll.rearm(r, vanilla.poll.POLLIN)
+        assert poll.poll(timeout=0) == []
+        poll.modify(r, vanilla.poll.POLLIN, mode=vanilla.poll.ONESHOT)
+        assert poll.poll() == [(r, vanilla.poll.POLLIN)]
+
+    def test_maxevents(self, backend):
+        poll = backend(maxevents=2)
+        pipes = [os.pipe() for _ in xrange(3)]
+        for r, w in pipes:
+            poll.register(r, vanilla.poll.POLLIN, mode=vanilla.poll.LEVEL)
+            os.write(w, '1')
+        assert len(poll.poll()) == 2
+
+    def test_hub(self, backend):
+        h = vanilla.Hub(poll=backend)
+
+        server = h.tcp.listen()
+
+        @h.spawn
+        def _():
+            conn = server.recv()
+            conn.send(conn.recv_n(1024 * 1024))
+
+        client = h.tcp.connect(server.port)
+        want = 'x' * 1024 * 1024
+        h.spawn(client.send, want)
+        assert client.recv_n(len(want)) == want
+
+        h.stop()
+        assert not h.registered
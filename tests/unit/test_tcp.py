@@ -1,3 +1,10 @@
+import socket
+import errno
+import ssl
+import os
+
+import pytest
+
 import vanilla
 
 
@@ -18,3 +25,244 @@ class TestTCP(object):
 
         h.stop()
         assert not h.registered
+
+    def test_read_into(self):
+        h = vanilla.Hub()
+        server = h.tcp.listen(size=1024, into=True)
+
+        want = 'x' * 100000
+
+        @h.spawn
+        def _():
+            conn = server.recv()
+            conn.send(conn.recv_n(len(want)))
+
+        client = h.tcp.connect(server.port, size=65536, into=True)
+        client.send(want)
+        assert client.recv_n(len(want)) == want
+
+        h.stop()
+        assert not h.registered
+
+    def test_connect(self):
+        h = vanilla.Hub()
+        server = h.tcp.listen()
+        client = h.tcp.connect(server.port)
+        conn = server.recv()
+        client.send('hi')
+        assert conn.recv() == 'hi'
+        assert h.tcp.connects == 1
+        assert h.tcp.connect_errors == 0
+        assert 0 <= h.tcp.connect_max <= h.tcp.connect_time
+
+        # nothing listening
+        port = server.port
+        server.close()
+        conn.close()
+        client.close()
+        h.sleep(1)
+        e = pytest.raises(socket.error, h.tcp.connect, port)
+        assert e.value.errno == errno.ECONNREFUSED
+        assert h.tcp.connect_errors == 1
+        h.stop()
+
+    def test_connect_timeout(self):
+        h = vanilla.Hub()
+
+        # a listener which never accepts; once its backlog is full, further
+        # handshakes don't complete
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(0)
+        port = sock.getsockname()[1]
+
+        ticks = []
+        h.spawn(lambda: [ticks.append(h.sleep(5)) for _ in xrange(100)])
+
+        clients = []
+        with pytest.raises(vanilla.Timeout):
+            for _ in xrange(10):
+                clients.append(h.tcp.connect(port, timeout=50))
+        # the hub kept running while the connect was pending
+        assert len(ticks) >= 5
+        assert h.tcp.connect_errors == 1
+
+        for client in clients:
+            client.close()
+        sock.close()
+        h.stop()
+
+    def test_accept(self):
+        h = vanilla.Hub()
+        server = h.tcp.listen(batch=2)
+
+        clients = [h.tcp.connect(server.port) for _ in xrange(5)]
+        h.sleep(10)
+        # accepted connections are buffered for the consumer, but only up to
+        # around batch before accepting stalls
+        assert 2 <= server.accepted < 5
+        assert server.queued > 0
+
+        conns = [server.recv() for _ in xrange(5)]
+        assert server.accepted == 5
+        assert server.queued == 0
+        assert server.connections == 5
+
+        for conn in conns:
+            conn.close()
+        assert server.connections == 0
+        assert server.rejected == 0
+
+        for client in clients:
+            client.close()
+        h.stop()
+
+    def test_max_connections(self):
+        h = vanilla.Hub()
+        server = h.tcp.listen(max_connections=2)
+
+        clients = [h.tcp.connect(server.port) for _ in xrange(3)]
+        conn1 = server.recv()
+        conn2 = server.recv()
+        # the third connection waits in the backlog
+        pytest.raises(vanilla.Timeout, server.recv, timeout=20)
+        assert server.accepted == 2
+
+        # until there's room for it
+        conn1.close()
+        conn3 = server.recv()
+        assert server.accepted == 3
+        assert server.connections == 2
+
+        conn3.send('hi')
+        assert clients[2].recv() == 'hi'
+
+        for conn in [conn2, conn3] + clients:
+            conn.close()
+        h.stop()
+
+    def test_max_connections_close(self):
+        h = vanilla.Hub()
+        server = h.tcp.listen(max_connections=1)
+
+        client = h.tcp.connect(server.port)
+        conn = server.recv()
+        # the accept loop pauses at the limit
+        waiting = h.tcp.connect(server.port)
+        pytest.raises(vanilla.Timeout, server.recv, timeout=20)
+
+        # closing the server while it's paused stops listening
+        server.close()
+        h.sleep(10)
+        pytest.raises(socket.error, h.tcp.connect, server.port)
+
+        # and connections closing afterwards don't touch the old listener
+        conn.close()
+        h.sleep(10)
+
+        for c in [client, waiting]:
+            c.close()
+        h.stop()
+
+    def test_workers(self):
+        h = vanilla.Hub()
+
+        def serve(hub, server):
+            for conn in server:
+                conn.send(str(os.getpid()))
+
+        supervisor = h.tcp.listen(workers=2, serve=serve)
+        assert len(supervisor.workers) == 2
+
+        def connect():
+            # retry until the workers are listening
+            while True:
+                try:
+                    return h.tcp.connect(supervisor.port)
+                except socket.error:
+                    h.sleep(10)
+
+        pids = set(
+            int(connect().recv()) for _ in xrange(50))
+        assert pids == set(child.pid for child in supervisor.workers)
+
+        # a worker which dies is restarted
+        supervisor.workers[0].terminate()
+        while not supervisor.restarts:
+            h.sleep(10)
+        assert len(supervisor.workers) == 2
+        assert int(connect().recv()) in set(
+            child.pid for child in supervisor.workers)
+
+        supervisor.close()
+        while supervisor.workers:
+            h.sleep(10)
+        h.stop()
+
+    def test_tls(self):
+        h = vanilla.Hub()
+        server = h.tcp.listen(tls=server_context(), into=True)
+
+        # large enough for both ends to fill their socket buffers
+        want = 'x' * 4000000
+
+        @h.spawn
+        def _():
+            conn = server.recv()
+            conn.send(conn.recv_n(len(want)))
+
+        client = h.tcp.connect(
+            server.port, host='localhost', tls=client_context())
+        h.spawn(client.send, want)
+        assert client.recv_n(len(want)) == want
+        assert server.connections == 1
+
+        client.close()
+        h.sleep(10)
+        assert server.connections == 0
+        server.close()
+        h.stop()
+        assert not h.registered
+
+    def test_tls_handshake(self):
+        h = vanilla.Hub()
+        server = h.tcp.listen(tls=server_context(), timeout=50)
+
+        # a client which stalls its handshake doesn't hold up others
+        stalled = h.tcp.connect(server.port)
+        client = h.tcp.connect(
+            server.port, host='localhost', tls=client_context())
+        conn = server.recv(timeout=1000)
+        client.send('hi')
+        assert conn.recv() == 'hi'
+
+        h.sleep(100)
+        assert server.rejected == 1
+        assert server.connections == 1
+        # the stalled connection was closed
+        pytest.raises(vanilla.Closed, stalled.recv)
+
+        # a server which never responds times out the client's handshake
+        plain = h.tcp.listen()
+        with pytest.raises(vanilla.Timeout):
+            h.tcp.connect(plain.port, tls=client_context(), timeout=50)
+        assert h.tcp.connect_errors == 1
+
+        # the certificate is checked
+        with pytest.raises(ssl.SSLError):
+            h.tcp.connect(server.port, tls=True)
+        assert h.tcp.connect_errors == 2
+        h.stop()
+
+
+def server_context():
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.load_cert_chain(CERT)
+    return context
+
+
+def client_context():
+    return ssl.create_default_context(cafile=CERT)
+
+
+CERT = os.path.join(os.path.dirname(__file__), 'cert.pem')
@@ -8,3 +8,4 @@ from vanilla.exception import Timeout
 from vanilla.exception import Closed
 from vanilla.exception import Stop
 from vanilla.exception import Halt
+from vanilla.exception import Overflow
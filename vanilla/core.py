@@ -1,12 +1,15 @@
 from __future__ import absolute_import
 
 import collections
+import ctypes.util
 import functools
 import importlib
 import logging
 import signal
+import ctypes
 import heapq
 import time
+import sys
 
 
 from greenlet import getcurrent
@@ -30,16 +33,45 @@ class lazy(object):
         return value
 
 
+# Attempt to use a monotonic clock, so scheduled items aren't thrown off by
+# changes to the wall clock. Falls back to time.time if clock_gettime isn't
+# available.
+
+try:
+    CLOCK_MONOTONIC = 6 if sys.platform == 'darwin' else 1
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    clock_gettime = libc.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def monotonic():
+        t = timespec()
+        rc = clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t))
+        assert not rc, 'clock_gettime failed: %s' % ctypes.get_errno()
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    monotonic()
+except Exception:
+    log.warn('unable to load clock_gettime: falling back to time.time')
+
+    def monotonic():
+        return time.time()
+
+
 class Scheduler(object):
     Item = collections.namedtuple('Item', ['due', 'action', 'args'])
 
-    def __init__(self):
+    def __init__(self, clock=monotonic):
+        self.clock = clock
         self.count = 0
         self.queue = []
         self.removed = {}
 
     def add(self, delay, action, *args):
-        due = time.time() + (delay / 1000.0)
+        due = self.clock() + (delay / 1000.0)
         item = self.Item(due, action, args)
         heapq.heappush(self.queue, item)
         self.count += 1
@@ -61,7 +93,7 @@ class Scheduler(object):
 
     def timeout(self):
         self.prune()
-        return self.queue[0].due - time.time()
+        return self.queue[0].due - self.clock()
 
     def pop(self):
         self.prune()
@@ -70,6 +102,225 @@ class Scheduler(object):
         return item.action, item.args
 
 
+def lowest(mask):
+    """
+    Returns the index of the lowest set bit in *mask*
+    """
+    return (mask & -mask).bit_length() - 1
+
+
+class TimerWheel(object):
+    """
+    A hierarchical timer wheel with the same interface as `Scheduler`. Adding
+    and removing an item are O(1): items are hashed into a slot by their due
+    tick, rather than being pushed onto a heap, and removed items are dropped
+    from their slot immediately.
+
+    The wheel has a level of 256 slots of *resolution* milliseconds, and four
+    coarser levels of 64 slots, each slot spanning an entire turn of the level
+    below. As time advances, the slot of a coarser level that comes due is
+    cascaded down into the finer levels.
+
+    *clock* is a callable returning the current time in seconds.
+    """
+    class Item(object):
+        __slots__ = ['due', 'tick', 'action', 'args', 'level', 'index']
+
+        def __init__(self, due, tick, action, args):
+            self.due = due
+            self.tick = tick
+            self.action = action
+            self.args = args
+            self.level = None
+            self.index = None
+
+        def __lt__(self, other):
+            return self.tick < other.tick
+
+    ROOT_BITS = 8
+    LEVEL_BITS = 6
+    LEVELS = 5
+
+    def __init__(self, resolution=1, clock=monotonic):
+        self.clock = clock
+        self.resolution = resolution / 1000.0
+        self.count = 0
+
+        bits = [self.ROOT_BITS] + [self.LEVEL_BITS] * (self.LEVELS - 1)
+        self.shifts = [sum(bits[:level]) for level in xrange(self.LEVELS)]
+        self.sizes = [1 << x for x in bits]
+        self.span = (1 << sum(bits)) - 1
+
+        self.wheels = [[set() for _ in xrange(size)] for size in self.sizes]
+        # a bitmask per level of which slots are occupied
+        self.occupied = [0] * self.LEVELS
+
+        self.cursor = self.to_tick(self.clock())
+        # a heap of the earliest items, used to find the next item due when
+        # the finest level's current turn is empty. see gather.
+        self.upcoming = None
+        self.horizon = None
+
+    def to_tick(self, due):
+        # round up, so items never fire before they're due
+        return -int(-due // self.resolution)
+
+    def place(self, item):
+        delta = item.tick - self.cursor
+
+        if delta < 0:
+            # overdue, so run on the next pop
+            level, index = 0, self.cursor & (self.sizes[0] - 1)
+        elif delta >> self.ROOT_BITS == 0:
+            level, index = 0, item.tick & (self.sizes[0] - 1)
+        else:
+            tick = item.tick
+            if delta > self.span:
+                tick = self.cursor + self.span
+                delta = self.span
+            level = 1 + (
+                delta.bit_length() - self.ROOT_BITS - 1) // self.LEVEL_BITS
+            index = (tick >> self.shifts[level]) & (self.sizes[level] - 1)
+
+        self.wheels[level][index].add(item)
+        self.occupied[level] |= 1 << index
+        item.level = level
+        item.index = index
+
+    def unplace(self, item):
+        slot = self.wheels[item.level][item.index]
+        slot.discard(item)
+        if not slot:
+            self.occupied[item.level] &= ~(1 << item.index)
+        item.level = item.index = None
+
+    def add(self, delay, action, *args):
+        due = self.clock() + (delay / 1000.0)
+        item = self.Item(due, self.to_tick(due), action, args)
+        self.place(item)
+        self.count += 1
+        if self.upcoming is not None and item.tick <= self.horizon:
+            heapq.heappush(self.upcoming, item)
+        return item
+
+    def __len__(self):
+        return self.count
+
+    def remove(self, item):
+        if item.level is None:
+            return
+        self.unplace(item)
+        self.count -= 1
+
+    def cascade(self):
+        for level in xrange(1, self.LEVELS):
+            index = (self.cursor >> self.shifts[level]) & \
+                (self.sizes[level] - 1)
+            slot = self.wheels[level][index]
+            if slot:
+                self.wheels[level][index] = set()
+                self.occupied[level] &= ~(1 << index)
+                for item in slot:
+                    self.place(item)
+            if index:
+                break
+
+    def advance(self, tick):
+        """
+        Moves the cursor forward to *tick*, cascading coarser levels as turns
+        of the finest level are completed. The cursor won't move past an
+        occupied slot, so overdue items are never skipped.
+        """
+        if not self.count:
+            self.cursor = max(self.cursor, tick)
+            return
+
+        mask = self.sizes[0] - 1
+        while self.cursor < tick:
+            ahead = self.occupied[0] >> (self.cursor & mask)
+            if ahead:
+                self.cursor = min(tick, self.cursor + lowest(ahead))
+                return
+            boundary = (self.cursor | mask) + 1
+            if tick < boundary:
+                self.cursor = tick
+                return
+            self.cursor = boundary
+            self.cascade()
+
+    def gather(self):
+        """
+        Collects the items of the first occupied slot of each level into a
+        heap. Every item with a tick up to *horizon* is then in the heap, so
+        its top is the earliest item until it passes the horizon.
+        """
+        mask = self.sizes[0] - 1
+        boundary = (self.cursor | mask) + 1
+        upcoming = []
+        horizons = []
+
+        # items in the finest level that wrap into its next turn
+        behind = self.occupied[0] & ((1 << (self.cursor & mask)) - 1)
+        if behind:
+            index = lowest(behind)
+            upcoming.extend(self.wheels[0][index])
+            horizons.append(boundary + index)
+
+        # the first occupied slot of each coarser level, in the order the slots
+        # will be cascaded
+        for level in xrange(1, self.LEVELS):
+            occupied = self.occupied[level]
+            if not occupied:
+                continue
+            size = self.sizes[level]
+            shift = self.shifts[level]
+            start = ((self.cursor >> shift) + 1) & (size - 1)
+            rotated = (occupied >> start) | (
+                (occupied << (size - start)) & ((1 << size) - 1))
+            offset = lowest(rotated)
+            upcoming.extend(self.wheels[level][(start + offset) & (size - 1)])
+            horizons.append(
+                (((self.cursor >> shift) + 2 + offset) << shift) - 1)
+
+        heapq.heapify(upcoming)
+        self.upcoming = upcoming
+        self.horizon = min(horizons)
+
+    def peek(self):
+        """
+        Returns the tick and an item of the earliest occupied slot.
+        """
+        mask = self.sizes[0] - 1
+
+        # the common case: an item is due in the finest level's current turn
+        ahead = self.occupied[0] >> (self.cursor & mask)
+        if ahead:
+            tick = self.cursor + lowest(ahead)
+            return tick, next(iter(self.wheels[0][tick & mask]))
+
+        upcoming = self.upcoming
+        if upcoming is not None:
+            # skip over items which have been removed
+            while upcoming and upcoming[0].level is None:
+                heapq.heappop(upcoming)
+        if not upcoming or upcoming[0].tick > self.horizon:
+            self.gather()
+            upcoming = self.upcoming
+        item = upcoming[0]
+        return item.tick, item
+
+    def timeout(self):
+        now = self.clock()
+        self.advance(self.to_tick(now))
+        tick, _ = self.peek()
+        return tick * self.resolution - now
+
+    def pop(self):
+        _, item = self.peek()
+        self.remove(item)
+        return item.action, item.args
+
+
 class Hub(object):
     """
     A Vanilla Hub is a handle to a self contained world of interwoven
@@ -78,19 +329,56 @@ class Hub(object):
     this Hub is explicit and must be passed to coroutines that need to interact
     with it. This is particularly nice for testing, as it makes it clear what's
     going on, and other tests can't inadvertently effect each other.
+
+    *scheduler* is the class used to keep track of scheduled callables. It
+    defaults to a heap based `Scheduler`; a `TimerWheel` is better suited to
+    hubs with a large number of pending timeouts.
+
+    *pool_size* is the maximum number of idle green threads to keep around to
+    run spawned callables, rather than creating a new green thread for each.
+    Pooling is off by default. *pool_hits* and *pool_misses* count how many
+    callables were run on a pooled green thread, or needed a new one.
+
+    *poll* is the poller backend, either a class or the name of one in
+    `vanilla.poll.backends`: 'epoll', 'kqueue', 'poll' or 'select'. It
+    defaults to the best available on this platform.
     """
-    def __init__(self):
+    def __init__(self, scheduler=Scheduler, pool_size=0, poll=None):
         self.log = logging.getLogger('%s.%s' % (__name__, self.__class__))
 
+        self.pool_size = pool_size
+        self.pool = []
+        self.pool_hits = 0
+        self.pool_misses = 0
+
+        self.clock = monotonic
+        self.cached = self.clock()
+
         self.ready = collections.deque()
-        self.scheduled = Scheduler()
+        self.scheduled = scheduler(clock=self.now)
 
         self.stopped = self.state()
 
         self.registered = {}
-        self.poll = vanilla.poll.Poll()
+        if poll is None:
+            poll = vanilla.poll.Poll
+        elif isinstance(poll, basestring):
+            poll = vanilla.poll.backends[poll]
+        self.poll = poll()
         self.loop = greenlet(self.main)
 
+    def now(self):
+        """
+        Returns the current time in seconds from a monotonic clock. The clock
+        is read once per iteration of the Hub's loop, so this is the time as
+        of the start of the current iteration::
+
+            start = h.now()
+            h.sleep(50)
+            h.now() - start # returns 0.05
+        """
+        return self.cached
+
     def __getattr__(self, name):
         # facilitates dynamic plugin look up
         try:
@@ -378,14 +666,19 @@ class Hub(object):
         self.scheduled.add(ms, getcurrent())
         self.loop.switch()
 
-    def register(self, fd, *masks):
+    def register(self, fd, *masks, **kw):
+        """
+        Registers *fd* with the poller for each of *masks*, and returns a
+        Recver per mask which is sent True when the fd becomes ready. The
+        trigger *mode* defaults to vanilla.poll.EDGE.
+        """
         ret = []
         self.registered[fd] = {}
         for mask in masks:
             sender, recver = self.pipe()
             self.registered[fd][mask] = sender
             ret.append(recver)
-        self.poll.register(fd, *masks)
+        self.poll.register(fd, *masks, **kw)
         if len(ret) == 1:
             return ret[0]
         return ret
@@ -424,11 +717,51 @@ class Hub(object):
         try:
             if isinstance(task, greenlet):
                 task.switch(*a)
-            else:
+            elif not self.pool_size:
                 greenlet(task).switch(*a)
+            elif self.pool:
+                self.pool_hits += 1
+                self.pool.pop().switch(task, a)
+            else:
+                self.pool_misses += 1
+                worker = greenlet(self.worker)
+                worker.switch()
+                worker.switch(task, a)
         except Exception, e:
             self.log.warn('Exception leaked back to main loop', exc_info=e)
 
+    def worker(self):
+        """
+        Runs spawned callables back to back on a pooled green thread. While
+        the next thing ready is another callable the worker runs it straight
+        away, otherwise it parks itself in the pool, unless the pool is full
+        in which case it exits.
+        """
+        # callables are always handed over by a switch, rather than as
+        # arguments, as the arguments would be held for the worker's lifetime
+        task, a = self.loop.switch()
+        while True:
+            try:
+                task(*a)
+            except Exception, e:
+                self.log.warn('Exception leaked back to main loop', exc_info=e)
+                e = None
+                sys.exc_clear()
+
+            if self.ready and not isinstance(self.ready[0][0], greenlet):
+                self.pool_hits += 1
+                task, a = self.ready.popleft()
+                continue
+
+            # drop our references to the last callable, so anything it was
+            # holding can be garbage collected, e.g. to abandon a Pipe
+            task = a = None
+
+            if len(self.pool) >= self.pool_size:
+                return
+            self.pool.append(getcurrent())
+            task, a = self.loop.switch()
+
     def dispatch_events(self, events):
         for fd, mask in events:
             if fd in self.registered:
@@ -440,9 +773,43 @@ class Hub(object):
                     if masks[mask].ready:
                         masks[mask].send(True)
 
+    def dispatch(self, events):
+        """
+        Wakes green threads parked on registered file descriptors directly
+        from the loop, as a single batch for each return of poll. Errors close
+        the registered pipes, which may need to pause, so they're handed off
+        to dispatch_events on a new green thread.
+        """
+        errors = []
+        for fd, mask in events:
+            masks = self.registered.get(fd)
+            if masks is None:
+                continue
+
+            if mask == vanilla.poll.POLLERR:
+                errors.append((fd, mask))
+                continue
+
+            sender = masks.get(mask)
+            try:
+                if sender is None or not sender.ready:
+                    continue
+            except vanilla.exception.Halt:
+                continue
+
+            recver = sender.other
+            self.run_task(recver.peak, recver, True)
+
+        if errors:
+            self.spawn(self.dispatch_events, errors)
+
     def main(self):
         """
         Scheduler steps:
+            - read the clock, which is cached for the rest of the iteration
+
+            - dispatch events from the last poll
+
             - run ready until exhaustion
 
             - if there's something scheduled
@@ -457,7 +824,17 @@ class Hub(object):
               is scheduled
         """
 
+        events = None
+
         while True:
+            self.cached = self.clock()
+
+            # dispatch here, rather than straight after the poll, so woken
+            # green threads see an up to date clock
+            if events:
+                self.dispatch(events)
+                events = None
+
             while self.ready:
                 task, a = self.ready.popleft()
                 self.run_task(task, *a)
@@ -470,11 +847,10 @@ class Hub(object):
                     self.run_task(task, *a)
                     continue
 
-                # if nothing registered, just sleep until next scheduled
+                # if nothing registered, just sleep until next scheduled and
+                # then go back to run it, once the clock has been read
                 if not self.registered:
                     time.sleep(timeout)
-                    task, a = self.scheduled.pop()
-                    self.run_task(task, *a)
                     continue
             else:
                 timeout = -1
@@ -485,11 +861,8 @@ class Hub(object):
                 return
 
             # run poll
-            events = None
             try:
                 events = self.poll.poll(timeout=timeout)
             # IOError from a signal interrupt
             except IOError:
                 pass
-            if events:
-                self.spawn(self.dispatch_events, events)
@@ -18,6 +18,10 @@ class Abandoned(Halt):
     pass
 
 
+class Overflow(Exception):
+    pass
+
+
 # TODO: think through HTTP Exceptions
 class ConnectionLost(Exception):
     pass
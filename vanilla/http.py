@@ -1,5 +1,7 @@
 import collections
+import re
 import functools
+import itertools
 import urlparse
 import logging
 import hashlib
@@ -9,7 +11,6 @@ import struct
 import json
 import time
 import uuid
-import ssl
 import os
 
 import vanilla.exception
@@ -26,22 +27,116 @@ log = logging.getLogger(__name__)
 class __plugin__(object):
     def __init__(self, hub):
         self.hub = hub
+        self.pools = {}
+        # the cached Date header value, and whether it's been asked for
+        # since it was last refreshed
+        self._date = None
+        self.dated = False
+
+    def connect(self, url, **kw):
+        """
+        Returns an HTTPClient connection to *url*'s host; *kw* is passed on
+        to HTTPClient.
+
+        For https urls the server's certificate and hostname are verified by
+        default, using the hub's shared ssl.create_default_context(). Earlier
+        versions didn't verify, so connections to servers with self-signed or
+        otherwise untrusted certificates now fail with ssl.SSLError, unless
+        an SSLContext which trusts them is passed as *tls*.
+        """
+        return HTTPClient(self.hub, url, **kw)
+
+    def pool(self, url, **kw):
+        """
+        Returns the shared Pool of connections for *url*'s scheme, host and
+        port, creating it with *kw* the first time it's asked for.
+        """
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pools[key] = Pool(
+                self.hub, '%s://%s' % (parsed.scheme, parsed.netloc), **kw)
+        return pool
 
-    def connect(self, url):
-        return HTTPClient(self.hub, url)
+    def request(
+            self, method, uri, params=None, headers=None, data=None):
+        """
+        Makes a request for *uri* on a pooled connection, and returns a Recver
+        for the response.
+        """
+        parsed = urlparse.urlsplit(uri)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        return self.pool(uri).request(method, path, params, headers, data)
 
-    # TODO: hacking in convenience for example, still need to add test
-    # TODO: ensure connection is closed after the get is done
     def get(self, uri, params=None, headers=None):
-        parsed = urlparse.urlsplit(uri)
-        conn = self.connect('%s://%s' % (parsed.scheme, parsed.netloc))
-        return conn.get(parsed.path, params=params, headers=headers)
+        return self.request('GET', uri, params, headers, None)
+
+    def post(self, uri, params=None, headers=None, data=''):
+        return self.request('POST', uri, params, headers, data)
+
+    def date(self):
+        """
+        Returns the current time formatted for a Date header. The value is
+        cached, and refreshed once a second for as long as it's being asked
+        for, rather than formatted for every response.
+        """
+        self.dated = True
+        if self._date is None:
+            self._date = http_date()
+            self.hub.spawn(self.refresh)
+        return self._date
+
+    def refresh(self):
+        try:
+            while self.dated:
+                self.dated = False
+                self.hub.sleep(1000)
+                self._date = http_date()
+        except vanilla.exception.Halt:
+            pass
+        self._date = None
+
+    def listen(
+            self, port=0, host='127.0.0.1', tls=None, max_connections=0,
+            **kw):
+        """
+        Listens for HTTP connections on *port*, and returns a Recver of
+        HTTPServer connections; *kw* is passed on to each HTTPServer.
+
+        With *max_connections*, once that many connections are open the one
+        which has been idle the longest is closed to make room for a new one.
+        If none are idle the new connection is closed instead.
+        """
+        server = self.hub.tcp.listen(host=host, port=port, tls=tls)
+        if not max_connections:
+            ret = server.map(
+                lambda conn: HTTPServer(self.hub, conn, **kw))
+            ret.port = server.port
+            return ret
+
+        connections = set()
+
+        @server.pipe
+        def ret(recver, sender):
+            for conn in recver:
+                if len(connections) >= max_connections:
+                    idle = [x for x in connections if x.idle is not None]
+                    if not idle:
+                        conn.close()
+                        continue
+                    oldest = min(idle, key=lambda x: x.idle)
+                    connections.discard(oldest)
+                    oldest.socket.close()
+                conn = HTTPServer(self.hub, conn, **kw)
+                connections.add(conn)
+                conn.socket.onclose(connections.discard, conn)
+                sender.send(conn)
 
-    def listen(self, port=0, host='127.0.0.1'):
-        server = self.hub.tcp.listen(host=host, port=port)
-        ret = server.map(
-            lambda conn: HTTPServer(self.hub, conn))
         ret.port = server.port
+        ret.connections = connections
         return ret
 
 
@@ -108,24 +203,98 @@ REASON_PHRASES = {
 }
 
 
+# status lines for each Status(code), ready to send
+STATUS_LINES = dict(
+    ((code, reason), '%s %s %s\r\n' % (HTTP_VERSION, code, reason))
+    for code, reason in REASON_PHRASES.iteritems())
+
+
 def Status(code):
     return code, REASON_PHRASES[code]
 
 
-class Headers(object):
-    Value = collections.namedtuple('Value', ['key', 'value'])
+def http_date(when=None):
+    return time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(when))
+
+
+# header names we expect to see often, mapped from their usual spellings to
+# an interned lower case key; lookups for these skip lower() and compare by
+# identity
+COMMON_HEADERS = [
+    'Accept', 'Accept-Encoding', 'Accept-Language', 'Authorization',
+    'Cache-Control', 'Connection', 'Content-Encoding', 'Content-Length',
+    'Content-Type', 'Cookie', 'Date', 'Expect', 'Host', 'If-Modified-Since',
+    'If-None-Match', 'Keep-Alive', 'Location', 'Origin', 'Referer',
+    'Sec-WebSocket-Accept', 'Sec-WebSocket-Key', 'Sec-WebSocket-Version',
+    'Server', 'Set-Cookie', 'Transfer-Encoding', 'Upgrade', 'User-Agent',
+    'X-Forwarded-For', 'X-Requested-With', ]
+
+HEADER_KEYS = {}
+for name in COMMON_HEADERS:
+    HEADER_KEYS[name] = HEADER_KEYS[name.lower()] = intern(name.lower())
+del name
+
+
+# a block of header fields per RFC 7230: each a token, a colon and a value
+# without line breaks. the last line of a head has had its line ending
+# stripped along with the blank line that follows it.
+HEADERS = re.compile(
+    r"(?:[!#$%&'*+.^_`|~0-9A-Za-z-]+:[^\r\n]*(?:\r\n|\Z))*\Z")
+
+
+def parse_headers(head, pos=0, limit=None):
+    """
+    Parses the header lines in *head*, starting at *pos*, into
+    :class:`Headers`.
+
+    Raises ValueError if a line isn't a valid header, and
+    :class:`vanilla.exception.Overflow` if there are more than *limit*
+    headers.
+    """
+    # the block is checked in one pass by the regex; after that, splitting
+    # it up is cheaper than capturing each field with the regex
+    if not HEADERS.match(head, pos):
+        raise ValueError('malformed headers')
+    lines = (head[pos:] if pos else head).split('\r\n')
+    if lines[-1] == '':
+        lines.pop()
+    if limit is not None and len(lines) > limit:
+        raise vanilla.exception.Overflow('more than %s headers' % limit)
+    store = {}
+    for line in lines:
+        key, _, value = line.partition(':')
+        store[HEADER_KEYS.get(key) or key.lower()] = (key, value.strip(' \t'))
+    return Headers(store)
+
+
+DECIMAL = re.compile(r'[0-9]+\Z')
+HEX = re.compile(r'[0-9A-Fa-f]+\Z')
+
+
+def parse_length(value, base=10):
+    """
+    Parses a Content-Length, or with *base* 16 a chunk size. Raises
+    ValueError unless *value* is a non-negative number; int() alone would
+    also take a sign, whitespace or a 0x prefix.
+    """
+    if not (HEX if base == 16 else DECIMAL).match(value):
+        raise ValueError('invalid length: %r' % value[:32])
+    return int(value, base)
+
 
-    def __init__(self):
-        self.store = {}
+class Headers(object):
+    def __init__(self, store=None):
+        # lower case key -> (key as received, value)
+        self.store = {} if store is None else store
 
     def __setitem__(self, key, value):
-        self.store[key.lower()] = self.Value(key, value)
+        self.store[HEADER_KEYS.get(key) or key.lower()] = (key, value)
 
     def __contains__(self, key):
-        return key.lower() in self.store
+        return (HEADER_KEYS.get(key) or key.lower()) in self.store
 
     def __getitem__(self, key):
-        return self.store[key.lower()].value
+        return self.store[HEADER_KEYS.get(key) or key.lower()][1]
 
     def __repr__(self):
         return repr(dict(self.store.itervalues()))
@@ -138,29 +307,83 @@ class Headers(object):
 
 
 class HTTPSocket(object):
-
-    def recv_headers(self):
-        headers = Headers()
+    # the longest head, or chunk line, we'll buffer before giving up on the
+    # connection
+    MAX_LINE = 65536
+    # the most header fields we'll accept in a single head
+    MAX_HEADERS = 100
+
+    def recv_head(self, timeout=-1, socket=None):
+        """
+        Receives a request or response head. The entire head is taken from
+        the stream's buffer in one piece and parsed in a single pass.
+
+        *timeout* is for the head as a whole, rather than each read of it, so
+        a peer trickling its head in can't hold the connection indefinitely.
+
+        Returns the head's first line, and its :class:`Headers`. *socket*
+        defaults to this connection's current socket.
+        """
+        recver = (socket or self.socket).recver
+        if timeout > -1:
+            deadline = self.hub.now() + timeout / 1000.0
+        head = ''
+        while not head:
+            if timeout > -1:
+                # wait until a complete head, or more than can be one, is
+                # buffered. like recv_partition, each search resumes where
+                # the last one stopped
+                start = recver.offset
+                while recver.buffer.find('\r\n\r\n', start) == -1:
+                    if recver.max_length is not None and \
+                            recver.buffered() > recver.max_length:
+                        break
+                    start = max(recver.offset, len(recver.buffer) - 3)
+                    recver.fill(
+                        timeout=max(0, (deadline - self.hub.now()) * 1000))
+            # tolerate stray line endings between messages, RFC 7230 3.5
+            head = recver.recv_partition('\r\n\r\n').lstrip('\r\n')
+        end = head.find('\r\n')
+        if end == -1:
+            return head, Headers()
+        return head[:end], parse_headers(head, end + 2, self.MAX_HEADERS)
+
+    def recv_headers(self, timeout=-1):
+        """
+        Receives header lines up until a blank line; used for the trailers
+        that follow a chunked body.
+        """
+        lines = []
         while True:
-            line = self.socket.recv_line()
+            line = self.socket.recv_line(timeout=timeout)
             if not line:
                 break
-            k, v = line.split(': ', 1)
-            headers[k] = v.strip()
-        return headers
-
-    def send_headers(self, headers):
-        headers = '\r\n'.join(
-            '%s: %s' % (k, v) for k, v in headers.iteritems())
-        self.socket.send(headers+'\r\n'+'\r\n')
-
-    def recv_chunk(self):
-        length = int(self.socket.recv_line(), 16)
+            if len(lines) == self.MAX_HEADERS:
+                raise vanilla.exception.Overflow(
+                    'more than %s headers' % self.MAX_HEADERS)
+            lines.append(line)
+        return parse_headers('\r\n'.join(lines))
+
+    def format_headers(self, headers, line=''):
+        """
+        Serializes *headers*, preceded by the start *line* if given, into a
+        single string ending with the blank line.
+        """
+        fields = ['%s: %s\r\n' % item for item in headers.iteritems()]
+        return '%s%s\r\n' % (line, ''.join(fields))
+
+    def send_headers(self, headers, line=''):
+        self.socket.send(self.format_headers(headers, line))
+
+    def recv_chunk(self, timeout=-1, socket=None):
+        socket = socket or self.socket
+        length = parse_length(socket.recv_line(timeout=timeout), 16)
         if length:
-            chunk = self.socket.recv_n(length)
+            chunk = socket.recv_n(length, timeout=timeout)
         else:
             chunk = ''
-        assert self.socket.recv_n(2) == '\r\n'
+        if socket.recv_n(2, timeout=timeout) != '\r\n':
+            raise ValueError('chunk not terminated')
         return chunk
 
     def send_chunk(self, chunk):
@@ -168,9 +391,40 @@ class HTTPSocket(object):
 
 
 class HTTPClient(HTTPSocket):
+    """
+    An HTTP/1.1 connection to *url*'s host.
+
+    Requests are pipelined: each is written as soon as it's made, without
+    waiting for the responses to those before it, with up to *depth*
+    requests in flight. Further requests wait for a response to complete.
+
+    *timeout* is the default deadline, in milliseconds from when a request is
+    made, for its response to be read. The deadline covers waiting for room
+    in the pipeline and writing the request, as well as reading the
+    response. A request which misses its deadline is sent vanilla.Timeout,
+    and as the responses pipelined behind it can no longer be matched up,
+    the connection is dropped.
+
+    When the connection is lost, the requests outstanding on it are sent
+    vanilla.ConnectionLost. If *reconnect* is set, those which hadn't been
+    written yet, and idempotent ones which had, are written again on a new
+    connection instead.
+
+    For https, *tls* is the SSLContext to use; by default the hub's shared
+    client context, which verifies the server's certificate and hostname.
+
+    A request's *data* can be a string, a dict to form encode, or a Recver
+    or any other iterable of chunks, which is streamed with chunked transfer
+    encoding, or as is if a Content-Length header is given. Chunks are only
+    taken from the source as the socket accepts them.
+    """
 
     Status = collections.namedtuple('Status', ['version', 'code', 'message'])
 
+    # methods which are safe to send again if their response was lost
+    IDEMPOTENT = frozenset(
+        ['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+
     class Response(object):
         def __init__(self, status, headers, body):
             self.status = status
@@ -186,7 +440,31 @@ class HTTPClient(HTTPSocket):
         def __repr__(self):
             return 'HTTPClient.Response(status=%r)' % (self.status,)
 
-    def __init__(self, hub, url):
+    class Request(object):
+        __slots__ = [
+            'method', 'path', 'params', 'headers', 'data', 'response',
+            'deadline', 'written', 'answered']
+
+        def __init__(
+                self, method, path, params, headers, data, response, deadline):
+            self.method = method
+            self.path = path
+            self.params = params
+            self.headers = headers
+            self.data = data
+            self.response = response
+            self.deadline = deadline
+            self.written = False
+            self.answered = False
+
+    def __init__(
+            self,
+            hub,
+            url,
+            tls=None,
+            depth=10,
+            timeout=-1,
+            reconnect=False):
         self.hub = hub
 
         parsed = urlparse.urlsplit(url)
@@ -194,19 +472,18 @@ class HTTPClient(HTTPSocket):
         assert parsed.fragment == ''
 
         default_port = 443 if parsed.scheme == 'https' else 80
-        host, port = urllib.splitnport(parsed.netloc, default_port)
+        self.host, self.port = urllib.splitnport(parsed.netloc, default_port)
 
-        self.socket = self.hub.tcp.connect(host=host, port=port)
+        # https uses the SSLContext *tls*, or the hub's shared client context
+        if parsed.scheme != 'https':
+            tls = None
+        elif tls is None:
+            tls = True
+        self.tls = tls
 
-        # TODO: this shouldn't block on the SSL handshake
-        if parsed.scheme == 'https':
-            # TODO: what a mess
-            conn = self.socket.sender.fd.conn
-            conn = ssl.wrap_socket(conn)
-            conn.setblocking(0)
-            self.socket.sender.fd.conn = conn
-
-        self.socket.recver.sep = '\r\n'
+        self.depth = depth
+        self.timeout = timeout
+        self.reconnect = reconnect
 
         self.agent = 'vanilla/%s' % vanilla.meta.__version__
 
@@ -215,42 +492,208 @@ class HTTPClient(HTTPSocket):
             ('User-Agent', self.agent),
             ('Host', parsed.netloc), ])
 
-        self.requests = self.hub.router().pipe(self.hub.queue(10))
-        self.requests.pipe(self.hub.consumer(self.writer))
+        # requests made and not yet answered, oldest first
+        self.inflight = collections.deque()
+        # requests waiting for room in the pipeline
+        self.slots = self.hub.dealer()
+        # whether the watch greenlet is enforcing deadlines
+        self.watching = False
+        # whether a connect is underway, and those waiting for it to finish
+        self.connecting = False
+        self.connects = self.hub.dealer()
+        self.socket = None
+        self.closed = False
+        self.connect()
+
+    def connect(self):
+        """
+        Makes a new connection, replacing the current one. If a connect is
+        already underway this waits for it instead, raising ConnectionLost if
+        it fails, so concurrent reconnects share a single new connection.
+        """
+        if self.connecting:
+            self.connects.recv()
+            if not self.connected:
+                raise vanilla.exception.ConnectionLost('reconnect failed')
+            return
+
+        self.connecting = True
+        try:
+            socket = self.hub.tcp.connect(
+                host=self.host, port=self.port, tls=self.tls)
+            if self.socket is not None:
+                # the connection being replaced
+                self.socket.close()
+            self.socket = socket
+            self.socket.recver.sep = '\r\n'
+            self.socket.recver.max_length = self.MAX_LINE
+
+            self.connected = True
+            # whether the connection can be used for more once the requests
+            # on it are answered
+            self.keepalive = True
+
+            # requests to write, and written requests waiting on their
+            # responses
+            self.requests = self.hub.queue(self.depth)
+            self.responses = self.hub.queue(self.depth)
+            self.hub.spawn(
+                self.writer, self.socket, self.requests.recver,
+                self.responses.sender)
+            self.hub.spawn(self.reader, self.socket, self.responses.recver)
+        finally:
+            self.connecting = False
+            while self.connects.sender.ready:
+                self.connects.send(True)
+
+    def lost(self, socket):
+        """
+        Drops the connection *socket*, and fails or requeues the requests
+        outstanding on it.
+        """
+        socket.close()
+        if socket is not self.socket or not self.connected:
+            return
+        self.connected = False
+        self.keepalive = False
+        self.requests.close()
+        self.responses.close()
+
+        retry = []
+        now = self.hub.clock()
+        while self.inflight:
+            request = self.inflight.popleft()
+            if request.deadline and request.deadline <= now:
+                self.fail(request, vanilla.exception.Timeout('deadline'))
+            elif self.reconnect and not self.closed and \
+                    self.retryable(request):
+                retry.append(request)
+            else:
+                self.fail(request, vanilla.exception.ConnectionLost())
 
-        self.responses = self.hub.router().pipe(self.hub.queue(10))
-        self.responses.pipe(self.hub.consumer(self.reader))
+        if retry:
+            try:
+                self.connect()
+            except Exception, e:
+                log.warn('reconnect failed: %s', e)
+                for request in retry:
+                    self.fail(request, vanilla.exception.ConnectionLost())
+                retry = []
+            for request in retry:
+                request.written = False
+                self.inflight.append(request)
+                self.requests.send(request)
+
+        # wake everything waiting for room in the pipeline
+        while self.slots.sender.ready:
+            self.slots.send(True)
+
+    def retryable(self, request):
+        if not request.written:
+            return True
+        # a streamed body can't be sent again once any of it has been taken
+        if request.data is not None and \
+                not isinstance(request.data, (basestring, dict)):
+            return False
+        return request.method in self.IDEMPOTENT
+
+    def fail(self, request, e):
+        @self.hub.spawn
+        def _():
+            try:
+                request.response.send(e)
+            except vanilla.exception.Halt:
+                pass
 
-    def reader(self, response):
+    def done(self, request):
+        self.inflight.popleft()
+        if self.slots.sender.ready:
+            self.slots.send(True)
+
+    def remaining(self, request):
+        # milliseconds until *request*'s deadline
+        if not request.deadline:
+            return -1
+        return max(0, (request.deadline - self.hub.clock()) * 1000)
+
+    def watch(self):
+        # drops the connection when a request misses its deadline before its
+        # response arrives, e.g. while it's stuck being written, for as long
+        # as there are deadlines to enforce
         try:
-            version, code, message = self.socket.recv_line().split(' ', 2)
+            while True:
+                deadlines = [
+                    request.deadline for request in self.inflight
+                    if request.deadline and not request.answered]
+                if not deadlines:
+                    break
+                wait = min(deadlines) - self.hub.clock()
+                if wait > 0:
+                    self.hub.sleep(wait * 1000)
+                else:
+                    self.lost(self.socket)
+                    # the connection may already be being dropped elsewhere,
+                    # so let that finish before looking again
+                    self.hub.sleep(0)
         except vanilla.exception.Halt:
-            # TODO: could we offer the ability to auto-reconnect?
+            pass
+        self.watching = False
+
+    def reader(self, socket, responses):
+        for request in responses:
             try:
-                response.send(vanilla.exception.ConnectionLost())
-            except vanilla.exception.Abandoned:
-                # TODO: super need to think this through
-                pass
-            return
+                if not self.read(socket, request):
+                    return
+            except vanilla.exception.Timeout, e:
+                if not request.answered:
+                    self.done(request)
+                    self.fail(request, e)
+                self.lost(socket)
+                return
+            except (
+                    vanilla.exception.Halt,
+                    vanilla.exception.Overflow,
+                    ValueError):
+                # a malformed response leaves the connection unusable
+                self.lost(socket)
+                return
 
-        code = int(code)
-        status = self.Status(version, code, message)
+    def read(self, socket, request):
+        """
+        Reads the response to *request* from *socket*. Returns False if the
+        connection has been taken over, and shouldn't be read any further.
+        """
+        line, headers = self.recv_head(
+            timeout=self.remaining(request), socket=socket)
+        version, code, message = line.split(' ', 2)
+        status = self.Status(version, int(code), message)
         # TODO:
         # if status.code == 408:
 
-        headers = self.recv_headers()
         sender, recver = self.hub.pipe()
 
-        response.send(self.Response(status, headers, recver))
+        connection = headers.get('Connection', '').lower()
+        if connection == 'close' or \
+                (version == 'HTTP/1.0' and connection != 'keep-alive'):
+            self.keepalive = False
+
+        request.answered = True
+        request.response.send(self.Response(status, headers, recver))
+        # only the caller holds on to the body, so that it's abandoned if
+        # they drop it without reading it
+        del recver
 
-        if headers.get('Connection') == 'Upgrade':
+        if connection == 'upgrade':
+            self.keepalive = False
+            self.done(request)
             sender.close()
-            return
+            return False
 
         try:
             if headers.get('transfer-encoding') == 'chunked':
                 while True:
-                    chunk = self.recv_chunk()
+                    chunk = self.recv_chunk(
+                        timeout=self.remaining(request), socket=socket)
                     if not chunk:
                         break
                     sender.send(chunk)
@@ -264,22 +707,41 @@ class HTTPClient(HTTPSocket):
                     content-length isn't in header, assume body is marked by
                     connection closed
                     """
+                    self.keepalive = False
                     body = ''
                     while True:
                         try:
-                            body += self.socket.recv()
+                            body += socket.recv(
+                                timeout=self.remaining(request))
                         except vanilla.exception.Closed:
                             break
                     sender.send(body)
                 else:
-                    body = self.socket.recv_n(int(length))
+                    body = socket.recv_n(
+                        parse_length(length), timeout=self.remaining(request))
                     sender.send(body)
 
-        except vanilla.exception.Halt:
-            # TODO: could we offer the ability to auto-reconnect?
-            sender.send(vanilla.exception.ConnectionLost())
+        except (
+                vanilla.exception.Halt,
+                vanilla.exception.Timeout,
+                ValueError), e:
+            self.keepalive = False
+            self.done(request)
+            if not isinstance(e, vanilla.exception.Timeout):
+                e = vanilla.exception.ConnectionLost()
+            try:
+                sender.send(e)
+            except vanilla.exception.Halt:
+                # the body was dropped without being read
+                pass
+            # either way the body's finished with, which runs its closers,
+            # e.g. to give a pooled connection's slot back
+            sender.close()
+            raise
 
+        self.done(request)
         sender.close()
+        return True
 
     def request(
             self,
@@ -287,59 +749,138 @@ class HTTPClient(HTTPSocket):
             path='/',
             params=None,
             headers=None,
-            data=None):
-
-        self.requests.send((method, path, params, headers, data))
+            data=None,
+            timeout=None):
+        """
+        Makes a request, and returns a Recver for its Response. *timeout*
+        overrides the connection's default deadline for this request.
+        """
         sender, recver = self.hub.pipe()
-        self.responses.send(sender)
+        self.send(self.Request(
+            method, path, params, headers, data, sender,
+            self.deadline(timeout)))
         return recver
 
-    def writer(self, request):
-        method, path, params, headers, data = request
-
-        request_headers = {}
-        request_headers.update(self.default_headers)
-        if headers:
-            request_headers.update(headers)
-
-        if params:
-            path += '?' + urllib.urlencode(params)
-
-        request = '%s %s %s\r\n' % (method, path, HTTP_VERSION)
-        self.socket.send(request)
+    def deadline(self, timeout=None):
+        # the deadline, in hub.clock() seconds, for a request made now with
+        # *timeout*, or False for none
+        if timeout is None:
+            timeout = self.timeout
+        return timeout >= 0 and self.hub.clock() + timeout / 1000.0
+
+    def send(self, request):
+        """
+        Sends *request*, once there's room in the pipeline. Its Response, or
+        an exception, is sent on request.response.
+        """
+        while len(self.inflight) >= self.depth:
+            try:
+                self.slots.recv(timeout=self.remaining(request))
+            except vanilla.exception.Timeout, e:
+                self.fail(request, e)
+                return
 
-        # TODO: handle chunked transfers
-        if data is not None:
+        if self.connected and not self.inflight and \
+                self.socket.recver.halted:
+            # closed while idle, so nothing was reading it
+            self.lost(self.socket)
+        if not self.connected:
+            if not self.reconnect or self.closed:
+                self.fail(request, vanilla.exception.ConnectionLost())
+                return
+            self.connect()
+
+        self.inflight.append(request)
+        if request.deadline and not self.watching:
+            self.watching = True
+            self.hub.spawn(self.watch)
+        self.requests.send(request)
+
+    def writer(self, socket, requests, responses):
+        for request in requests:
+            # from here some of the request may have reached the server
+            request.written = True
+            try:
+                self.write(socket, request)
+                responses.send(request)
+            except vanilla.exception.Halt:
+                self.lost(socket)
+                return
+            except Exception, e:
+                # a streamed body which failed part way through leaves the
+                # connection unusable
+                log.warn('request body failed: %s', e)
+                self.lost(socket)
+                return
 
-            if isinstance(data, dict):
-                request_headers['Content-Type'] = \
-                    'application/x-www-form-urlencoded'
-                data = urllib.urlencode(data)
+    def write(self, socket, request):
+        # only ever writes to *socket*, which may no longer be the client's
+        # current connection by the time this resumes
+        path = request.path
+        if request.params:
+            path += '?' + urllib.urlencode(request.params)
 
+        request_headers = {}
+        request_headers.update(self.default_headers)
+        if request.headers:
+            request_headers.update(request.headers)
+
+        data = request.data
+        chunked = False
+        if isinstance(data, dict):
+            request_headers['Content-Type'] = \
+                'application/x-www-form-urlencoded'
+            data = urllib.urlencode(data)
+        if isinstance(data, basestring):
             request_headers['Content-Length'] = len(data)
+        elif data is not None:
+            # a Recver or other iterable is streamed, with chunked encoding
+            # unless the length was given
+            chunked = not any(
+                k.lower() == 'content-length' for k in request_headers)
+            if chunked:
+                request_headers['Transfer-Encoding'] = 'chunked'
+
+        socket.sender.cork()
+        socket.send(self.format_headers(
+            request_headers,
+            '%s %s %s\r\n' % (request.method, path, HTTP_VERSION)))
+        if isinstance(data, basestring):
+            socket.send(data)
+        socket.sender.flush()
+
+        if data is None or isinstance(data, basestring):
+            return
 
-        self.send_headers(request_headers)
-
-        # TODO: handle chunked transfers
-        if data is not None:
-            self.socket.send(data)
-
-    def get(self, path='/', params=None, headers=None, auth=None):
+        # each chunk is written before the next is taken, so a slow socket
+        # holds up the source rather than having it buffered here
+        for chunk in data:
+            if not chunk:
+                continue
+            if chunked:
+                chunk = '%s\r\n%s\r\n' % (hex(len(chunk))[2:], chunk)
+            socket.send(chunk)
+        if chunked:
+            socket.send('0\r\n\r\n')
+
+    def get(
+            self, path='/', params=None, headers=None, auth=None,
+            timeout=None):
         if auth:
             if not headers:
                 headers = {}
             headers['Authorization'] = \
                 'Basic ' + base64.b64encode('%s:%s' % auth)
-        return self.request('GET', path, params, headers, None)
+        return self.request('GET', path, params, headers, None, timeout)
 
-    def post(self, path='/', params=None, headers=None, data=''):
-        return self.request('POST', path, params, headers, data)
+    def post(self, path='/', params=None, headers=None, data='', timeout=None):
+        return self.request('POST', path, params, headers, data, timeout)
 
-    def put(self, path='/', params=None, headers=None, data=''):
-        return self.request('PUT', path, params, headers, data)
+    def put(self, path='/', params=None, headers=None, data='', timeout=None):
+        return self.request('PUT', path, params, headers, data, timeout)
 
-    def delete(self, path='/', params=None, headers=None):
-        return self.request('DELETE', path, params, headers, None)
+    def delete(self, path='/', params=None, headers=None, timeout=None):
+        return self.request('DELETE', path, params, headers, None, timeout)
 
     def websocket(self, path='/', params=None, headers=None):
         key = base64.b64encode(uuid.uuid4().bytes)
@@ -359,39 +900,279 @@ class HTTPClient(HTTPSocket):
 
         return WebSocket(self.hub, self.socket)
 
+    def reusable(self):
+        """
+        Whether this connection has no requests outstanding and can be used
+        for more.
+        """
+        return self.connected and self.keepalive and not self.inflight and \
+            not self.socket.recver.halted
+
     def close(self):
-        # TODO: handle inflight requests?
+        self.closed = True
         self.socket.close()
 
 
+class Pool(object):
+    """
+    A pool of keep-alive HTTPClient connections to *url*'s host.
+
+    Connections are checked out for a request, and checked back in once its
+    response has been read. Up to *max_idle* connections are kept for reuse,
+    most recently used first, and are closed after *idle_timeout*
+    milliseconds unused. If *max_active* is set, requests wait for a
+    connection once that many are checked out.
+
+    A connection is checked to still be open before it's reused. A request
+    which finds the server closed a reused connection before any response
+    was received is retried, on a new connection once the idle ones run
+    out, as long as it's safe to send again: it hadn't been written yet, or
+    it's idempotent with a body that can be replayed.
+
+    *created*, *reused* and *retries* count connections and stale retries.
+    """
+    def __init__(
+            self,
+            hub,
+            url,
+            tls=None,
+            max_idle=10,
+            max_active=0,
+            idle_timeout=60000):
+        self.hub = hub
+        self.url = url
+        self.tls = tls
+        self.max_idle = max_idle
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+
+        # (expiry, client) for idle connections, oldest first
+        self.idle = collections.deque()
+        self.active = 0
+        # requests waiting for a connection when max_active is reached
+        self.waiting = self.hub.dealer()
+        self.sweeping = False
+
+        self.created = self.reused = self.retries = 0
+
+    def checkout(self):
+        """
+        Returns a connection and whether it's being reused.
+        """
+        if self.max_active and self.active >= self.max_active:
+            # the slot is handed over directly by checkin
+            self.waiting.recv()
+        else:
+            self.active += 1
+
+        try:
+            while self.idle:
+                _, client = self.idle.pop()
+                if client.reusable():
+                    self.reused += 1
+                    return client, True
+                client.close()
+
+            client = HTTPClient(self.hub, self.url, tls=self.tls)
+        except BaseException:
+            self.release()
+            raise
+        self.created += 1
+        return client, False
+
+    def checkin(self, client):
+        if client.reusable() and len(self.idle) < self.max_idle:
+            self.idle.append(
+                (self.hub.now() + self.idle_timeout / 1000.0, client))
+            if not self.sweeping:
+                self.sweeping = True
+                self.hub.spawn(self.sweep)
+        else:
+            client.close()
+        self.release()
+
+    def release(self):
+        if self.waiting.sender.ready:
+            self.waiting.send(True)
+        else:
+            self.active -= 1
+
+    def sweep(self):
+        # closes idle connections as they expire, for as long as there are
+        # any
+        try:
+            while self.idle:
+                self.hub.sleep(
+                    max(0, (self.idle[0][0] - self.hub.now()) * 1000))
+                now = self.hub.now()
+                while self.idle and self.idle[0][0] <= now:
+                    _, client = self.idle.popleft()
+                    client.close()
+        except vanilla.exception.Halt:
+            pass
+        self.sweeping = False
+
+    def request(
+            self,
+            method,
+            path='/',
+            params=None,
+            headers=None,
+            data=None,
+            timeout=None):
+        """
+        Makes a request on a pooled connection, and returns a Recver for the
+        response, like HTTPClient.request.
+        """
+        sender, recver = self.hub.pipe()
+
+        @self.hub.spawn
+        def _():
+            try:
+                response = self.fetch(
+                    method, path, params, headers, data, timeout)
+            except Exception, e:
+                sender.send(e)
+            else:
+                sender.send(response)
+
+        return recver
+
+    def fetch(self, method, path, params, headers, data, timeout):
+        deadline = None
+        while True:
+            client, reused = self.checkout()
+            try:
+                if deadline is None:
+                    # retries keep to the deadline of the first attempt
+                    deadline = client.deadline(timeout)
+                sender, recver = self.hub.pipe()
+                request = client.Request(
+                    method, path, params, headers, data, sender, deadline)
+                client.send(request)
+                response = recver.recv()
+            except vanilla.exception.ConnectionLost:
+                client.close()
+                self.release()
+                # a streamed body may have been partly taken already, and
+                # a retry would send only the rest of it
+                if reused and client.retryable(request) and \
+                        (data is None or isinstance(data, (basestring, dict))):
+                    self.retries += 1
+                    continue
+                raise
+            except BaseException:
+                client.close()
+                self.release()
+                raise
+            response.body.onclose(self.checkin, client)
+            return response
+
+    def get(self, path='/', params=None, headers=None):
+        return self.request('GET', path, params, headers, None)
+
+    def post(self, path='/', params=None, headers=None, data=''):
+        return self.request('POST', path, params, headers, data)
+
+    def close(self):
+        while self.idle:
+            _, client = self.idle.pop()
+            client.close()
+
+
 class HTTPServer(HTTPSocket):
-    def __init__(self, hub, socket):
+    """
+    An HTTP/1.1 server connection, which is a Recver of Requests.
+
+    A request body of up to *threshold* bytes is read before the Request is
+    received, and is its *body* as a string. A larger one, or one whose
+    Content-Length says it will be, is a Recver of chunks of the body as
+    they arrive instead, so the handler can start on it straight away and it
+    needn't fit in memory. Either way the body can be read in full with
+    Request.consume().
+
+    A streamed body has to be read through before the next request on the
+    connection can be; whatever of it the handler hasn't read when it asks
+    for the next request is discarded.
+
+    A request which says `Expect: 100-continue` is sent an interim 100
+    Continue response as its body is about to be read.
+
+    The connection is kept alive between requests. It's closed once:
+    - it's been idle, waiting for the next request to start, for more than
+      *idle_timeout* ms
+    - a request's head takes more than *header_timeout* ms to arrive
+    - *max_requests* requests have been served on it, if set
+    - a request asks for it with `Connection: close`, or is HTTP/1.0
+      without `Connection: keep-alive`
+
+    Closing after a final request is deferred until that request's response
+    has been written, and the response says `Connection: close`.
+    """
+    # a oneshot response body smaller than this goes out in the same buffer
+    # as the status line and headers
+    SMALL_BODY = 4096
+
+    def __init__(
+            self,
+            hub,
+            socket,
+            threshold=65536,
+            idle_timeout=60000,
+            header_timeout=60000,
+            max_requests=0):
         self.hub = hub
 
         self.socket = socket
         self.socket.recver.sep = '\r\n'
+        self.socket.recver.max_length = self.MAX_LINE
+
+        self.threshold = threshold
+        # the body being streamed, and set once it's been read through
+        self.streaming = None
+
+        self.idle_timeout = idle_timeout
+        self.header_timeout = header_timeout
+        self.max_requests = max_requests
+        self.served = 0
+        # False once the last request to be read on this connection has been
+        self.keepalive = True
+        # when this connection started waiting for its next request, or None
+        # while a request is in progress
+        self.idle = self.hub.now()
 
         self.responses = self.hub.router()
 
         @self.responses.consume
         def writer(response):
             status, headers, body = response
+            line = STATUS_LINES.get(status) or \
+                '%s %s %s\r\n' % (HTTP_VERSION, status[0], status[1])
+
+            # the status line, headers and a oneshot body go out in a single
+            # write
+            self.socket.sender.cork()
 
-            self.socket.send('HTTP/1.1 %s %s\r\n' % status)
+            if status[0] == 100:
+                # an interim response, with the final one still to come
+                self.send_headers(headers, line)
+                self.socket.sender.flush()
+                return
 
             if headers.get('Connection') == 'Upgrade':
-                self.send_headers(headers)
+                self.send_headers(headers, line)
+                self.socket.sender.flush()
                 self.responses.close()
                 return
 
-            headers.setdefault(
-                'Date',
-                time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime()))
+            if 'Date' not in headers:
+                headers['Date'] = self.hub.http.date()
 
             # if body is a pipe, use chunked encoding
             if hasattr(body, 'recv'):
                 headers['Transfer-Encoding'] = 'chunked'
-                self.send_headers(headers)
+                self.send_headers(headers, line)
+                self.socket.sender.flush()
                 for chunk in body:
                     self.send_chunk(chunk)
                 self.send_chunk('')
@@ -399,8 +1180,17 @@ class HTTPServer(HTTPSocket):
             # otherwise send in oneshot
             else:
                 headers['Content-Length'] = len(body)
-                self.send_headers(headers)
-                self.socket.send(body)
+                head = self.format_headers(headers, line)
+                if len(body) < self.SMALL_BODY:
+                    # cheaper to copy a small body than to send it separately
+                    self.socket.send(head + body)
+                else:
+                    self.socket.send(head)
+                    self.socket.send(body)
+                self.socket.sender.flush()
+
+            if headers.get('Connection') == 'close':
+                self.socket.close()
 
     Request = collections.namedtuple(
         'Request', ['method', 'path', 'version', 'headers'])
@@ -412,19 +1202,25 @@ class HTTPServer(HTTPSocket):
             if self.headers.get('Content-Type') != \
                     'application/x-www-form-urlencoded':
                 raise AttributeError('not a form encoded request')
-            return dict(urlparse.parse_qsl(self.body))
+            return dict(urlparse.parse_qsl(self.consume()))
 
         @property
         def form_multi(self):
             if self.headers.get('Content-Type') != \
                     'application/x-www-form-urlencoded':
                 raise AttributeError('not a form encoded request')
-            return urlparse.parse_qs(self.body)
+            return urlparse.parse_qs(self.consume())
 
         def consume(self):
+            if hasattr(self.body, 'recv'):
+                self.body = ''.join(self.body)
             return self.body
 
         def reply(self, status, headers, body):
+            if not self.keepalive:
+                headers.setdefault('Connection', 'close')
+            elif self.version == 'HTTP/1.0':
+                headers.setdefault('Connection', 'keep-alive')
             self.server.responses.send((status, headers, body))
 
         def upgrade(self):
@@ -450,15 +1246,125 @@ class HTTPServer(HTTPSocket):
                 self.server.hub, self.server.socket, is_client=False)
 
     def recv(self, timeout=None):
-        method, path, version = self.socket.recv_line().split(' ', 2)
-        headers = self.recv_headers()
+        if self.streaming is not None:
+            body, done = self.streaming
+            body.close()
+            done.recv()
+            self.streaming = None
+
+        if not self.keepalive:
+            raise vanilla.exception.Closed('connection closing')
+
+        recver = self.socket.recver
+        if not recver.buffered():
+            self.idle = self.hub.now()
+            recver.fill(timeout=self.idle_timeout)
+        self.idle = None
+
+        line, headers = self.recv_head(timeout=self.header_timeout)
+        method, path, version = line.split(' ', 2)
         request = self.Request(method, path, version, headers)
-        # TODO: handle chunked transfers
-        length = int(headers.get('content-length', 0))
-        request.body = self.socket.recv_n(length)
         request.server = self
+
+        self.served += 1
+        connection = headers.get('Connection', '').lower()
+        if connection == 'close' or \
+                (version == 'HTTP/1.0' and connection != 'keep-alive') or \
+                (self.max_requests and self.served >= self.max_requests):
+            self.keepalive = False
+        request.keepalive = self.keepalive
+
+        if version == 'HTTP/1.1' and \
+                headers.get('Expect', '').lower() == '100-continue':
+            self.responses.send((Status(100), {}, None))
+
+        if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            length = None
+        else:
+            length = parse_length(headers.get('Content-Length', '0'))
+
+        pieces = self.recv_body(length)
+        buffered = []
+        if length is None or length <= self.threshold:
+            size = 0
+            for piece in pieces:
+                buffered.append(piece)
+                size += len(piece)
+                if size > self.threshold:
+                    break
+            else:
+                request.body = ''.join(buffered)
+                return request
+
+        request.body = self.stream(itertools.chain(buffered, pieces))
         return request
 
+    def recv_body(self, length):
+        """
+        Yields a request body in pieces as they arrive: *length* bytes of it,
+        or chunked if *length* is None.
+        """
+        if length is not None:
+            for piece in self.recv_pieces(length):
+                yield piece
+            return
+
+        while True:
+            # ignoring any chunk extensions
+            length = parse_length(
+                self.socket.recv_line().split(';', 1)[0].rstrip(' \t'), 16)
+            if not length:
+                break
+            for piece in self.recv_pieces(length):
+                yield piece
+            if self.socket.recv_n(2) != '\r\n':
+                raise ValueError('chunk not terminated')
+        # trailers aren't passed on
+        self.recv_headers()
+
+    def recv_pieces(self, n):
+        # the next *n* bytes, in whatever pieces are already buffered
+        recver = self.socket.recver
+        while n:
+            if not recver.buffered():
+                recver.fill()
+            piece = recver.recv_n(min(n, recver.buffered()))
+            n -= len(piece)
+            yield piece
+
+    def stream(self, pieces):
+        sender, recver = self.hub.pipe()
+        done = self.hub.state()
+        self.streaming = (recver, done)
+
+        @self.hub.spawn
+        def _():
+            try:
+                for piece in pieces:
+                    try:
+                        sender.send(piece)
+                    except vanilla.exception.Halt:
+                        # the handler's done with the body, but it still has
+                        # to be read past
+                        for piece in pieces:
+                            pass
+                        break
+            except (
+                    vanilla.exception.Halt,
+                    vanilla.exception.Overflow,
+                    ValueError):
+                # the connection's lost, or the body's malformed
+                self.socket.close()
+                try:
+                    sender.send(vanilla.exception.ConnectionLost())
+                except vanilla.exception.Halt:
+                    pass
+            finally:
+                sender.close()
+                done.send(True)
+
+        return recver
+
     # TODO: we should provide the standard Recver API
     def __iter__(self):
         while True:
@@ -466,6 +1372,14 @@ class HTTPServer(HTTPSocket):
                 yield self.recv()
             except vanilla.exception.Halt:
                 break
+            except (
+                    vanilla.exception.Timeout,
+                    vanilla.exception.Overflow,
+                    ValueError):
+                # an idle connection, or a slow, oversized or malformed
+                # request
+                self.socket.close()
+                break
 
 
 class WebSocket(object):
@@ -1,9 +1,13 @@
+import collections
+import itertools
 import socket
 import fcntl
 import errno
 import ssl
 import os
 
+from greenlet import getcurrent
+
 import vanilla.exception
 import vanilla.message
 import vanilla.poll
@@ -12,22 +16,68 @@ import vanilla.poll
 class __plugin__(object):
     def __init__(self, hub):
         self.hub = hub
+        self._context = None
 
-    def fd_in(self, fd):
-        return Recver(FD_from_fileno_in(self.hub, fd))
+    def fd_in(self, fd, size=16384, into=False):
+        return Recver(FD_from_fileno_in(self.hub, fd), size=size, into=into)
 
     def fd_out(self, fd):
         return Sender(FD_from_fileno_out(self.hub, fd))
 
-    def pipe(self):
+    def pipe(self, size=16384, into=False):
         r, w = os.pipe()
-        recver = Recver(FD_from_fileno_in(self.hub, r))
+        recver = Recver(FD_from_fileno_in(self.hub, r), size=size, into=into)
         sender = Sender(FD_from_fileno_out(self.hub, w))
         return vanilla.message.Pair(sender, recver)
 
-    def socket(self, conn):
+    def socket(self, conn, size=16384, into=False):
         fd = FD_from_socket(self.hub, conn)
-        recver = vanilla.io.Recver(fd)
+        recver = vanilla.io.Recver(fd, size=size, into=into)
+        sender = vanilla.io.Sender(fd)
+        return vanilla.message.Pair(sender, recver)
+
+    def context(self):
+        """
+        Returns the default client SSLContext for this hub, which is shared by
+        all its TLS connections.
+        """
+        if self._context is None:
+            self._context = ssl.create_default_context()
+        return self._context
+
+    def tls(
+            self,
+            conn,
+            context=None,
+            server_side=False,
+            server_hostname=None,
+            timeout=-1,
+            size=16384,
+            into=False):
+        """
+        Runs a TLS handshake over the socket *conn* without blocking the hub,
+        and returns a Pair for the encrypted connection. Raises vanilla.Timeout
+        if the handshake doesn't complete within *timeout* milliseconds, or
+        ssl.SSLError if it fails; either way *conn* is closed.
+
+        *context* defaults to the hub's shared client context, which saves
+        loading the CA certificates for every connection. On the server side,
+        a shared context's session cache lets clients resume their sessions;
+        see its session_stats(). Client connections always run a full
+        handshake though: Python 2.7's ssl module has no way to offer a
+        previous session, so sharing a context resumes nothing for them.
+        """
+        if context is None:
+            context = self.context()
+        fd = FD_from_tls(
+            self.hub, conn, context,
+            server_side=server_side, server_hostname=server_hostname)
+        try:
+            fd.handshake(timeout=timeout)
+        except BaseException:
+            fd.close()
+            raise
+        recver = vanilla.io.Recver(fd, size=size, into=into)
         sender = vanilla.io.Sender(fd)
         return vanilla.message.Pair(sender, recver)
 
@@ -49,6 +99,12 @@ class FD_from_fileno_in(object):
     def read(self, n):
         return os.read(self.fileno, n)
 
+    def read_into(self, buffer):
+        # there's no os.readv in Python 2, so this is still a copy
+        data = os.read(self.fileno, len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
     def close(self):
         try:
             os.close(self.fileno)
@@ -88,6 +144,9 @@ class FD_from_socket(object):
     def read(self, n):
         return self.conn.recv(n)
 
+    def read_into(self, buffer):
+        return self.conn.recv_into(buffer)
+
     def write(self, data):
         return self.conn.send(data)
 
@@ -99,6 +158,67 @@ class FD_from_socket(object):
         self.hub.unregister(self.fileno)
 
 
+class FD_from_tls(FD_from_socket):
+    """
+    A TLS connection over a non-blocking socket. OpenSSL reports when it
+    needs the socket to be readable or writable to make progress; when that's
+    the direction being read or written it's raised as EAGAIN, for the
+    Recver and Sender to wait on as usual.
+    """
+    def __init__(
+            self, hub, conn, context, server_side=False, server_hostname=None):
+        super(FD_from_tls, self).__init__(hub, conn)
+        # the ssl module checks the socket's own idea of blocking, rather than
+        # the fd's flags
+        conn.setblocking(0)
+        self.conn = context.wrap_socket(
+            conn,
+            server_side=server_side,
+            do_handshake_on_connect=False,
+            server_hostname=server_hostname)
+
+    def handshake(self, timeout=-1):
+        deadline = timeout >= 0 and self.hub.clock() + timeout / 1000.0
+        while True:
+            try:
+                self.conn.do_handshake()
+                return
+            except ssl.SSLWantReadError:
+                mask, ready = vanilla.poll.POLLIN, self.pollin
+            except ssl.SSLWantWriteError:
+                mask, ready = vanilla.poll.POLLOUT, self.pollout
+            if deadline:
+                timeout = max(0, (deadline - self.hub.clock()) * 1000)
+            self.hub.poll.rearm(self.fileno, mask)
+            ready.recv(timeout=timeout)
+
+    def attempt(self, want, f, *a):
+        while True:
+            try:
+                return f(*a)
+            except ssl.SSLWantReadError:
+                mask = vanilla.poll.POLLIN
+            except ssl.SSLWantWriteError:
+                mask = vanilla.poll.POLLOUT
+            if mask == want:
+                raise socket.error(errno.EAGAIN, os.strerror(errno.EAGAIN))
+            # a read which needs to write, or the reverse, only happens on
+            # renegotiation, so rather than waiting on the other direction's
+            # readiness, which the other green thread may be consuming, just
+            # try again shortly
+            self.hub.sleep(1)
+
+    def read(self, n):
+        return self.attempt(vanilla.poll.POLLIN, self.conn.read, n)
+
+    def read_into(self, buffer):
+        return self.attempt(
+            vanilla.poll.POLLIN, self.conn.read, len(buffer), buffer)
+
+    def write(self, data):
+        return self.attempt(vanilla.poll.POLLOUT, self.conn.write, data)
+
+
 class Sender(object):
     def __init__(self, fd):
         self.fd = fd
@@ -108,22 +228,88 @@ class Sender(object):
         self.fd.pollout.pipe(self.gate)
         self.fd.pollout.onclose(self.close)
 
-        @self.hub.serialize
-        def send(data, timeout=-1):
-            # TODO: test timeout
+        # sends held back while corked, see cork()
+        self.corked = False
+        self.pending = []
+
+        # set while a writer owns the fd; other writers queue up in order
+        self.writing = False
+        self.waiting = collections.deque()
+
+    def write(self, data, timeout=-1):
+        # TODO: test timeout
+        if self.writing:
+            self.wait()
+        self.writing = True
+        try:
             while True:
                 try:
                     n = self.fd.write(data)
                 except (socket.error, OSError), e:
                     if e.errno == errno.EAGAIN:
+                        self.hub.poll.rearm(
+                            self.fd.fileno, vanilla.poll.POLLOUT)
                         self.gate.clear().recv()
                         continue
                     self.close()
                     raise vanilla.exception.Closed()
                 if n == len(data):
                     break
+                # continue from a view of what's left rather than copying it
+                if type(data) is not memoryview:
+                    data = memoryview(str(data))
                 data = data[n:]
-        self.send = send
+        finally:
+            self.release()
+
+    def wait(self):
+        # waits for the fd to be handed to us by the writer ahead
+        current = getcurrent()
+        self.waiting.append(current)
+        try:
+            self.hub.pause()
+        except BaseException:
+            if current in self.waiting:
+                self.waiting.remove(current)
+            else:
+                self.release()
+            raise
+
+    def release(self):
+        # hands the fd directly to the next writer in line, if there is one
+        if self.waiting:
+            self.hub.ready.append((self.waiting.popleft(), ()))
+        else:
+            self.writing = False
+
+    def send(self, data, timeout=-1):
+        if self.corked:
+            self.pending.append(data)
+            return
+        self.write(data, timeout=timeout)
+
+    def cork(self):
+        """
+        Holds back subsequent sends until :meth:`flush`, so they're written
+        together with a single write.
+        """
+        self.corked = True
+
+    def flush(self, timeout=-1):
+        """
+        Writes any sends held back by :meth:`cork`, and uncorks.
+        """
+        self.corked = False
+        if not self.pending:
+            return
+        # Python 2 has neither writev nor sendmsg, so the batch is joined
+        # into one buffer for the write
+        if len(self.pending) == 1:
+            data = self.pending[0]
+        else:
+            data = ''.join(self.pending)
+        self.pending = []
+        self.write(data, timeout=timeout)
 
     def connect(self, recver):
         recver.consume(self.send)
@@ -133,26 +319,42 @@ class Sender(object):
         self.fd.close()
 
 
-def Recver(fd):
+def Recver(fd, size=16384, into=False):
+    """
+    Returns a Stream Recver of the data read from *fd*, *size* bytes at a
+    time.
+
+    If *into* is set, each read is made into a buffer allocated once for this
+    *fd*, and the chunk sent is a memoryview of it, rather than a new string
+    per read. A chunk is only valid until the next read, so it should be
+    consumed with the Stream's methods, which copy it out.
+    """
     hub = fd.hub
-    sender, recver = hub.pipe()
+    sender, recver = vanilla.message.Stream(hub)
 
     recver.onclose(fd.close)
 
+    if into:
+        buffer = memoryview(bytearray(size))
+
+        def read():
+            return buffer[:fd.read_into(buffer)]
+    else:
+        def read():
+            return fd.read(size)
+
     @hub.spawn
     def _():
-        for _ in fd.pollin:
+        # read once before waiting, as data may already be buffered: in the
+        # kernel, before anyone was waiting for the fd's edge, or by OpenSSL
+        # during a TLS handshake
+        for _ in itertools.chain([True], fd.pollin):
             while True:
                 try:
-                    data = fd.read(16384)
+                    data = read()
                 except (socket.error, OSError), e:
                     if e.errno == errno.EAGAIN:
-                        break
-                    """
-                    # TODO: investigate handling non-blocking ssl correctly
-                    # perhaps SSL_set_fd() ??
-                    """
-                    if isinstance(e, ssl.SSLError):
+                        hub.poll.rearm(fd.fileno, vanilla.poll.POLLIN)
                         break
                     sender.close()
                     return
@@ -161,7 +363,11 @@ def Recver(fd):
                     sender.close()
                     return
 
-                sender.send(data)
+                try:
+                    sender.send(data)
+                except vanilla.exception.Halt:
+                    # closed by the recver while we were waiting on it
+                    return
         sender.close()
 
-    return vanilla.message.Stream(recver)
+    return recver
@@ -104,60 +104,11 @@ class Pair(Pair):
         self.recver.close()
 
 
-class Pipe(object):
-    """
-    ::
-
-                 +------+
-        send --> | Pipe | --> recv
-                 +------+
-
-    The most basic primitive is the Pipe. A Pipe has exactly one sender and
-    exactly one recver. A Pipe has no buffering, so send and recvs will block
-    until there is a corresponding send or recv.
-
-    For example, the following code will deadlock as the sender will block,
-    preventing the recv from ever being called::
-
-        h = vanilla.Hub()
-        p = h.pipe()
-        p.send(1)     # deadlock
-        p.recv()
-
-    The following is OK as the send is spawned to a background green thread::
-
-        h = vanilla.Hub()
-        p = h.pipe()
-        h.spawn(p.send, 1)
-        p.recv()      # returns 1
-    """
-    def __new__(cls, hub):
-        self = super(Pipe, cls).__new__(cls)
-        self.hub = hub
-        self.closed = False
-
-        recver = Recver(self)
-        self.recver = weakref.ref(recver, self.on_abandoned)
-        self.recver_current = None
-
-        sender = Sender(self)
-        self.sender = weakref.ref(sender, self.on_abandoned)
-        self.sender_current = None
-
-        return Pair(sender, recver)
-
-    def on_abandoned(self, *a, **kw):
-        remaining = self.recver() or self.sender()
-        if remaining:
-            # this is running from a preemptive callback triggered by the
-            # garbage collector. we spawn the abandon clean up in order to pull
-            # execution back under a green thread owned by our hub, and to
-            # minimize the amount of code running while preempted. note this
-            # means spawning needs to be atomic.
-            self.hub.spawn(remaining.abandoned)
-
-
 class End(object):
+    # __dict__ is kept so the odd end can carry extra attributes, e.g. the
+    # port of a listening server. it's only allocated once it's used.
+    __slots__ = ['middle', '__dict__', '__weakref__']
+
     def __init__(self, pipe):
         self.middle = pipe
 
@@ -228,6 +179,8 @@ class End(object):
 
 
 class Sender(End):
+    __slots__ = ['upstream']
+
     @property
     def current(self):
         return self.middle.sender_current
@@ -256,9 +209,12 @@ class Sender(End):
     def handover(self, recver):
         assert recver.ready
         recver.select()
-        # switch directly, as we need to pause
-        _, ret = recver.other.peak.switch(recver.other, None)
-        recver.unselect()
+        try:
+            # switch directly, as we need to pause. the sender may throw an
+            # exception back to us instead
+            _, ret = recver.other.peak.switch(recver.other, None)
+        finally:
+            recver.unselect()
         return ret
 
     def clear(self):
@@ -297,6 +253,8 @@ class Sender(End):
 
 
 class Recver(End):
+    __slots__ = ['downstream']
+
     @property
     def current(self):
         return self.middle.recver_current
@@ -435,6 +393,67 @@ class Recver(End):
                     break
 
 
+class Pipe(object):
+    """
+    ::
+
+                 +------+
+        send --> | Pipe | --> recv
+                 +------+
+
+    The most basic primitive is the Pipe. A Pipe has exactly one sender and
+    exactly one recver. A Pipe has no buffering, so send and recvs will block
+    until there is a corresponding send or recv.
+
+    For example, the following code will deadlock as the sender will block,
+    preventing the recv from ever being called::
+
+        h = vanilla.Hub()
+        p = h.pipe()
+        p.send(1)     # deadlock
+        p.recv()
+
+    The following is OK as the send is spawned to a background green thread::
+
+        h = vanilla.Hub()
+        p = h.pipe()
+        h.spawn(p.send, 1)
+        p.recv()      # returns 1
+    """
+    __slots__ = [
+        'hub', 'closed', 'closers',
+        'sender', 'sender_current', 'recver', 'recver_current']
+
+    # the classes of this Pipe's ends. specialized Pipes provide their own.
+    Sender = Sender
+    Recver = Recver
+
+    def __new__(cls, hub):
+        self = super(Pipe, cls).__new__(cls)
+        self.hub = hub
+        self.closed = False
+
+        self.recver_current = None
+        recver = cls.Recver(self)
+        self.recver = weakref.ref(recver, self.on_abandoned)
+
+        self.sender_current = None
+        sender = cls.Sender(self)
+        self.sender = weakref.ref(sender, self.on_abandoned)
+
+        return Pair(sender, recver)
+
+    def on_abandoned(self, *a, **kw):
+        remaining = self.recver() or self.sender()
+        if remaining:
+            # this is running from a preemptive callback triggered by the
+            # garbage collector. we spawn the abandon clean up in order to pull
+            # execution back under a green thread owned by our hub, and to
+            # minimize the amount of code running while preempted. note this
+            # means spawning needs to be atomic.
+            self.hub.spawn(remaining.abandoned)
+
+
 def Queue(hub, size):
     """
     ::
@@ -508,7 +527,7 @@ def Queue(hub, size):
     return Pair(upstream.sender, downstream.recver)
 
 
-class Dealer(object):
+class Dealer(Pipe):
     """
     ::
 
@@ -529,7 +548,15 @@ class Dealer(object):
         d.send(1)
         d.send(2)
     """
+    __slots__ = []
+
     class Recver(Recver):
+        __slots__ = []
+
+        def __init__(self, pipe):
+            super(Dealer.Recver, self).__init__(pipe)
+            self.current = collections.deque()
+
         def select(self):
             assert getcurrent() not in self.current
             self.current.append(getcurrent())
@@ -546,14 +573,8 @@ class Dealer(object):
             for current in waiters:
                 self.hub.throw_to(current, vanilla.exception.Abandoned)
 
-    def __new__(cls, hub):
-        sender, recver = hub.pipe()
-        recver.__class__ = Dealer.Recver
-        recver.current = collections.deque()
-        return Pair(sender, recver)
-
 
-class Router(object):
+class Router(Pipe):
     """
     ::
 
@@ -574,7 +595,15 @@ class Router(object):
         r.recv() # returns 2
         r.recv() # returns 1
     """
+    __slots__ = []
+
     class Sender(Sender):
+        __slots__ = []
+
+        def __init__(self, pipe):
+            super(Router.Sender, self).__init__(pipe)
+            self.current = collections.deque()
+
         def select(self):
             assert getcurrent() not in self.current
             self.current.append(getcurrent())
@@ -595,12 +624,6 @@ class Router(object):
             self.onclose(recver.close)
             recver.consume(self.send)
 
-    def __new__(cls, hub):
-        sender, recver = hub.pipe()
-        sender.__class__ = Router.Sender
-        sender.current = collections.deque()
-        return Pair(sender, recver)
-
 
 class Broadcast(object):
     def __init__(self, hub):
@@ -634,7 +657,7 @@ class Broadcast(object):
         recver.consume(self.send)
 
 
-class State(object):
+class State(Pipe):
     """
     State is a specialized `Pipe`_ which maintains the state of a previous
     send. Sends never block, but modify the object's current state.
@@ -657,6 +680,8 @@ class State(object):
         s.clear() # clear the current state
         s.recv()  # this will deadlock as state is not set
     """
+    __slots__ = []
+
     class G(object):
         def __init__(self, hub, state):
             self.hub = hub
@@ -670,6 +695,8 @@ class State(object):
             return self.state != NoState
 
     class Sender(Sender):
+        __slots__ = []
+
         def init_state(self, item):
             self.current = State.G(self.hub, item)
 
@@ -688,50 +715,130 @@ class State(object):
             return self.other
 
     def __new__(cls, hub, state=NoState):
-        sender, recver = hub.pipe()
-        sender.__class__ = State.Sender
-        sender.init_state(state)
-        return Pair(sender, recver)
+        pair = super(State, cls).__new__(cls, hub)
+        pair.sender.init_state(state)
+        return pair
 
 
-class Stream(object):
+class Stream(Pipe):
     """
-    A `Stream`_ is a specialized `Recver`_ which provides additional methods
-    for working with streaming sources, particularly sockets and file
+    A `Stream`_ is a specialized `Pipe`_ whose `Recver`_ provides additional
+    methods for working with streaming sources, particularly sockets and file
     descriptors.
     """
+    __slots__ = []
+
     class Recver(Recver):
+        """
+        Data received is buffered in a bytearray with a read cursor, so
+        consuming part of the buffer doesn't copy what remains, and growing
+        it is amortized rather than re-concatenating.
+        """
+        __slots__ = ['buffer', 'offset', 'sep', 'max_length']
+
+        # once this much has been consumed, and it's more than half the
+        # buffer, move the remainder to the front of the buffer
+        COMPACT = 65536
+
+        def __init__(self, pipe):
+            super(Stream.Recver, self).__init__(pipe)
+            self.buffer = bytearray()
+            self.offset = 0
+            self.sep = '\n'
+            self.max_length = None
+
+        def buffered(self):
+            """
+            Returns the number of bytes currently buffered.
+            """
+            return len(self.buffer) - self.offset
+
+        def fill(self, timeout=-1):
+            """
+            Receives the next chunk from our Sender into the buffer.
+            """
+            self.buffer += super(Stream.Recver, self).recv(timeout=timeout)
+
+        def view(self, n):
+            # a memoryview of the next *n* buffered bytes, which aren't
+            # consumed
+            return memoryview(self.buffer)[self.offset:self.offset + n]
+
+        def take(self, n, skip=0):
+            # consumes and returns the next *n* buffered bytes, and then
+            # discards a further *skip* bytes
+            buffer = self.buffer
+            offset = self.offset
+            got = memoryview(buffer)[offset:offset + n].tobytes()
+            offset += n + skip
+            if offset == len(buffer):
+                del buffer[:]
+                offset = 0
+            elif offset > self.COMPACT and offset > len(buffer) // 2:
+                del buffer[:offset]
+                offset = 0
+            self.offset = offset
+            return got
+
         def recv(self, timeout=-1):
-            if self.extra:
-                extra = self.extra
-                self.extra = ''
-                return extra
-            return super(Stream.Recver, self).recv(timeout=timeout)
+            if self.buffered():
+                return self.take(self.buffered())
+            got = super(Stream.Recver, self).recv(timeout=timeout)
+            # chunks read into a reused buffer arrive as views of it
+            if type(got) is memoryview:
+                got = got.tobytes()
+            return got
 
         def recv_n(self, n, timeout=-1):
             """
             Blocks until *n* bytes of data are available, and then returns
             them.
             """
-            got = ''
-            if n:
-                while len(got) < n:
-                    got += self.recv(timeout=timeout)
-                got, self.extra = got[:n], got[n:]
-            return got
+            while self.buffered() < n:
+                self.fill(timeout=timeout)
+            return self.take(n)
+
+        def recv_view(self, n, timeout=-1):
+            """
+            Like *recv_n*, but returns the *n* bytes as a memoryview, saving a
+            copy for callers that can work with views.
+            """
+            while self.buffered() < n:
+                self.fill(timeout=timeout)
+            # the view holds on to the current buffer, which can't be resized
+            # while it's exported, so continue with a new buffer
+            view = self.view(n)
+            self.buffer = self.buffer[self.offset + n:]
+            self.offset = 0
+            return view
 
         def recv_partition(self, sep, timeout=-1):
             """
             Blocks until the seperator *sep* is seen in the stream, and then
             returns all data received until *sep*.
+
+            If *max_length* is set on this recver and more than *max_length*
+            bytes arrive without a seperator, raises
+            :class:`vanilla.exception.Overflow`. The data stays buffered.
             """
-            got = ''
+            # each search resumes where the last one stopped, backing up just
+            # enough to catch a seperator split across two chunks
+            start = self.offset
             while True:
-                got += self.recv(timeout=timeout)
-                keep, matched, extra = got.partition(sep)
-                if matched:
-                    self.extra = extra
-                    return keep
+                index = self.buffer.find(sep, start)
+                if index != -1:
+                    length = index - self.offset
+                    if self.max_length is not None and \
+                            length > self.max_length:
+                        raise vanilla.exception.Overflow(
+                            'line exceeds %s bytes' % self.max_length)
+                    return self.take(length, skip=len(sep))
+                start = max(self.offset, len(self.buffer) - len(sep) + 1)
+                if self.max_length is not None and \
+                        start - self.offset > self.max_length:
+                    raise vanilla.exception.Overflow(
+                        'line exceeds %s bytes' % self.max_length)
+                self.fill(timeout=timeout)
 
         def recv_line(self, timeout=-1):
             """
@@ -741,8 +848,8 @@ class Stream(object):
             """
             return self.recv_partition(self.sep, timeout=timeout)
 
-    def __new__(cls, recver, sep='\n'):
-        recver.__class__ = Stream.Recver
-        recver.extra = ''
-        recver.sep = sep
-        return recver
+    def __new__(cls, hub, sep='\n', max_length=None):
+        pair = super(Stream, cls).__new__(cls, hub)
+        pair.recver.sep = sep
+        pair.recver.max_length = max_length
+        return pair
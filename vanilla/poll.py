@@ -1,3 +1,4 @@
+import collections
 import operator
 import select
 import errno
@@ -8,10 +9,156 @@ POLLOUT = 2
 POLLERR = 3
 
 
+# trigger modes for a registered fd. EDGE reports each change in readiness
+# once. LEVEL reports for as long as the fd stays ready. ONESHOT reports once
+# and then disarms the fd until it's rearmed with modify.
+#
+# after reading or writing until EAGAIN, callers should rearm the fd, which
+# is free for the kernel's edge triggered pollers, but lets the level
+# triggered ones emulate EDGE.
+EDGE = 0
+LEVEL = 1
+ONESHOT = 2
+
+
+class Base(object):
+    """
+    Keeps a shadow table of the interest set for each fd. register, modify
+    and unregister only record the interest wanted, and the changes are
+    applied in a batch right before the next poll. Changes that cancel out in
+    the meantime, like a register followed by an unregister, or registering
+    an fd again with the same interest, never reach the kernel.
+
+    ctls counts the calls made to change the kernel's interest set, polls the
+    calls made to wait for events, and skipped the changes which didn't need
+    a call.
+    """
+    def __init__(self):
+        # fd -> (masks, mode) as last applied to the kernel
+        self.interest = {}
+        # fd -> (masks, mode) wanted, or None to remove the fd
+        self.pending = {}
+        # fds removed since the last flush. they may have been closed, which
+        # drops them from the kernel, and their number reused
+        self.dropped = set()
+
+        self.ctls = 0
+        self.polls = 0
+        self.skipped = 0
+
+    def register(self, fd, *masks, **kw):
+        self.pending[fd] = (frozenset(masks), kw.get('mode', EDGE))
+
+    def modify(self, fd, *masks, **kw):
+        self.pending[fd] = (frozenset(masks), kw.get('mode', EDGE))
+
+    def unregister(self, fd, *masks):
+        self.pending[fd] = None
+        if fd in self.interest:
+            self.dropped.add(fd)
+
+    def rearm(self, fd, mask):
+        """
+        Called once *mask* on *fd* has been consumed until EAGAIN, so the next
+        change in readiness is reported.
+        """
+
+    def flush(self):
+        """
+        Applies pending changes to the kernel, returning a POLLERR event for
+        each fd whose change failed, e.g. because it was already closed.
+        """
+        errors = []
+        for fd, want in self.pending.iteritems():
+            have = self.interest.get(fd)
+            # a fired oneshot fd needs rearming, even if nothing has changed
+            if want == have and fd not in self.dropped and \
+                    (want is None or want[1] != ONESHOT):
+                self.skipped += 1
+                continue
+            try:
+                self.apply(fd, have, want)
+            except (IOError, OSError):
+                if want is not None:
+                    errors.append((fd, POLLERR))
+                want = None
+            if want is None:
+                self.interest.pop(fd, None)
+            else:
+                self.interest[fd] = want
+        self.pending.clear()
+        self.dropped.clear()
+        return errors
+
+
+class Level(Base):
+    """
+    Base for poll(2) and select(2), which are level triggered and keep no
+    state in the kernel. EDGE is emulated by disarming a mask on an fd once
+    it's been reported, until it's rearmed, so a writable socket isn't
+    reported on every iteration of the loop. An fd which errors is disarmed
+    entirely until it's registered again.
+
+    Subclasses implement wait, to wait for events on the armed masks.
+    """
+    def __init__(self, maxevents=-1):
+        super(Level, self).__init__()
+        self.maxevents = maxevents
+        # fd -> set of masks currently armed
+        self.armed = {}
+        self.modes = {}
+
+    def apply(self, fd, have, want):
+        if want is None:
+            self.armed.pop(fd, None)
+            self.modes.pop(fd, None)
+        else:
+            masks, mode = want
+            self.armed[fd] = set(masks)
+            self.modes[fd] = mode
+        self.changed(fd)
+
+    def changed(self, fd):
+        # called when the masks armed for fd change
+        pass
+
+    def rearm(self, fd, mask):
+        if self.modes.get(fd) == EDGE and mask in self.interest[fd][0]:
+            if mask not in self.armed[fd]:
+                self.armed[fd].add(mask)
+                self.changed(fd)
+
+    def poll(self, timeout=-1):
+        errors = self.flush()
+        if errors:
+            timeout = 0
+        self.polls += 1
+        events = self.wait(timeout)
+
+        ret = []
+        for fd, mask in events:
+            if self.maxevents > 0 and len(ret) >= self.maxevents:
+                break
+            if mask == POLLERR:
+                self.armed[fd].clear()
+            elif self.modes[fd] != LEVEL:
+                self.armed[fd].discard(mask)
+            ret.append((fd, mask))
+
+        for fd in set(fd for fd, mask in ret):
+            self.changed(fd)
+        return ret + errors
+
+
+backends = collections.OrderedDict()
+
+
 if hasattr(select, 'kqueue'):
-    class Poll(object):
-        def __init__(self):
+    class Kqueue(Base):
+        def __init__(self, maxevents=1024):
+            super(Kqueue, self).__init__()
             self.q = select.kqueue()
+            self.maxevents = maxevents
 
             self.to_ = {
                 select.KQ_FILTER_READ: POLLIN,
@@ -19,26 +166,48 @@ if hasattr(select, 'kqueue'):
 
             self.from_ = dict((v, k) for k, v in self.to_.iteritems())
 
-        def register(self, fd, *masks):
+            self.modes = {
+                EDGE: select.KQ_EV_CLEAR,
+                LEVEL: 0,
+                ONESHOT: select.KQ_EV_ONESHOT, }
+
+        def apply(self, fd, have, want):
+            # filters are independent in kqueue; add or update the ones
+            # wanted and delete the rest
+            have = have and have[0] or ()
+            masks, mode = want or ((), None)
+            changes = []
             for mask in masks:
-                event = select.kevent(
+                changes.append(select.kevent(
                     fd,
                     filter=self.from_[mask],
-                    flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR)
-                self.q.control([event], 0)
+                    flags=select.KQ_EV_ADD | self.modes[mode]))
+            for mask in have:
+                if mask not in masks:
+                    changes.append(select.kevent(
+                        fd,
+                        filter=self.from_[mask],
+                        flags=select.KQ_EV_DELETE))
 
-        def unregister(self, fd, *masks):
-            for mask in masks:
-                event = select.kevent(
-                    fd, filter=self.from_[mask], flags=select.KQ_EV_DELETE)
-                self.q.control([event], 0)
+            self.ctls += 1
+            try:
+                self.q.control(changes, 0)
+            except OSError, err:
+                # deleting from an fd which has already been closed is fine
+                if want is not None or \
+                        err.errno not in (errno.ENOENT, errno.EBADF):
+                    raise
 
         def poll(self, timeout=None):
+            errors = self.flush()
             if timeout == -1:
                 timeout = None
+            if errors:
+                timeout = 0
             while True:
                 try:
-                    events = self.q.control(None, 4, timeout)
+                    self.polls += 1
+                    events = self.q.control(None, self.maxevents, timeout)
                     break
                 except OSError, err:
                     if err.errno == errno.EINTR:
@@ -53,13 +222,18 @@ if hasattr(select, 'kqueue'):
                     ret.append((e.ident, POLLOUT))
                 if e.flags & (select.KQ_EV_EOF | select.KQ_EV_ERROR):
                     ret.append((e.ident, POLLERR))
-            return ret
+            return ret + errors
+
+    backends['kqueue'] = Kqueue
 
 
-elif hasattr(select, 'epoll'):
-    class Poll(object):
-        def __init__(self):
+if hasattr(select, 'epoll'):
+    class Epoll(Base):
+        def __init__(self, maxevents=-1):
+            super(Epoll, self).__init__()
             self.q = select.epoll()
+            # -1 lets Python size each poll's event list
+            self.maxevents = maxevents
 
             self.to_ = {
                 select.EPOLLIN: POLLIN,
@@ -67,16 +241,50 @@ elif hasattr(select, 'epoll'):
 
             self.from_ = dict((v, k) for k, v in self.to_.iteritems())
 
-        def register(self, fd, *masks):
+            self.modes = {
+                EDGE: select.EPOLLET,
+                LEVEL: 0,
+                ONESHOT: select.EPOLLONESHOT, }
+
+        def eventmask(self, masks, mode):
             masks = [self.from_[x] for x in masks] + [
-                select.EPOLLET, select.EPOLLERR, select.EPOLLHUP]
-            self.q.register(fd, reduce(operator.or_, masks, 0))
+                self.modes[mode], select.EPOLLERR, select.EPOLLHUP]
+            return reduce(operator.or_, masks, 0)
+
+        def apply(self, fd, have, want):
+            self.ctls += 1
+            if want is None:
+                try:
+                    self.q.unregister(fd)
+                except (IOError, OSError):
+                    # closing an fd removes it from the epoll set
+                    pass
+                return
 
-        def unregister(self, fd, *masks):
-            self.q.unregister(fd)
+            eventmask = self.eventmask(*want)
+            # the shadow table can be stale if the fd was closed and its
+            # number reused, so fall back on the other operation
+            try:
+                if have is None:
+                    self.q.register(fd, eventmask)
+                else:
+                    self.q.modify(fd, eventmask)
+            except (IOError, OSError), err:
+                if err.errno == errno.EEXIST:
+                    self.ctls += 1
+                    self.q.modify(fd, eventmask)
+                elif err.errno == errno.ENOENT:
+                    self.ctls += 1
+                    self.q.register(fd, eventmask)
+                else:
+                    raise
 
         def poll(self, timeout=-1):
-            events = self.q.poll(timeout=timeout)
+            errors = self.flush()
+            if errors:
+                timeout = 0
+            self.polls += 1
+            events = self.q.poll(timeout, self.maxevents)
             ret = []
             for fd, event in events:
                 for mask in self.to_:
@@ -84,7 +292,103 @@ elif hasattr(select, 'epoll'):
                         ret.append((fd, self.to_[mask]))
                 if event & (select.EPOLLERR | select.EPOLLHUP):
                     ret.append((fd, POLLERR))
+            return ret + errors
+
+    backends['epoll'] = Epoll
+
+
+if hasattr(select, 'poll'):
+    class SysPoll(Level):
+        """
+        poll(2), which isn't limited to FD_SETSIZE like select, but is still
+        linear in the number of fds for each call.
+        """
+        def __init__(self, maxevents=-1):
+            super(SysPoll, self).__init__(maxevents=maxevents)
+            self.q = select.poll()
+
+            self.to_ = {
+                select.POLLIN | select.POLLPRI: POLLIN,
+                select.POLLOUT: POLLOUT, }
+
+            self.from_ = {
+                POLLIN: select.POLLIN | select.POLLPRI,
+                POLLOUT: select.POLLOUT, }
+
+        def changed(self, fd):
+            # an fd with nothing armed is left out of the set entirely, or
+            # poll would keep reporting a hang up on it
+            masks = self.armed.get(fd)
+            if masks:
+                self.q.register(
+                    fd, reduce(operator.or_, map(self.from_.get, masks), 0))
+            else:
+                try:
+                    self.q.unregister(fd)
+                except KeyError:
+                    pass
+
+        def wait(self, timeout):
+            if timeout >= 0:
+                timeout *= 1000
+            else:
+                timeout = None
+            while True:
+                try:
+                    events = self.q.poll(timeout)
+                    break
+                except select.error, err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+            ret = []
+            for fd, event in events:
+                armed = self.armed[fd]
+                for mask in self.to_:
+                    if event & mask and self.to_[mask] in armed:
+                        ret.append((fd, self.to_[mask]))
+                if event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                    ret.append((fd, POLLERR))
             return ret
 
-else:
-    raise Exception('only epoll or kqueue supported')
+    backends['poll'] = SysPoll
+
+
+class Select(Level):
+    """
+    select(2), the portable fallback. It's limited to fds below FD_SETSIZE,
+    and doesn't report errors; they show up as readable or writable instead.
+    """
+    def wait(self, timeout):
+        r = [fd for fd, masks in self.armed.iteritems() if POLLIN in masks]
+        w = [fd for fd, masks in self.armed.iteritems() if POLLOUT in masks]
+        if timeout < 0:
+            timeout = None
+        while True:
+            try:
+                r, w, _ = select.select(r, w, [], timeout)
+                break
+            except select.error, err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                if err.args[0] != errno.EBADF:
+                    raise
+                # an fd was closed without being unregistered; find it
+                return [
+                    (fd, POLLERR) for fd in set(r + w) if not self.valid(fd)]
+        return [(fd, POLLIN) for fd in r] + [(fd, POLLOUT) for fd in w]
+
+    def valid(self, fd):
+        try:
+            select.select([fd], [], [], 0)
+        except select.error:
+            return False
+        return True
+
+
+backends['select'] = Select
+
+
+# the best of the backends available on this platform
+Poll = backends.values()[0]
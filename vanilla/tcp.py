@@ -1,42 +1,337 @@
+from __future__ import absolute_import
+
+import logging
+import signal
 import socket
 import errno
+import ssl
+import sys
+import os
 
 import vanilla.exception
 import vanilla.poll
 
 
+log = logging.getLogger(__name__)
+
+
+def bind(host, port, reuseport=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
 class __plugin__(object):
     def __init__(self, hub):
         self.hub = hub
+        # connect metrics: the number of connects made, how many of them
+        # failed, and the total and worst time taken by the successful ones,
+        # in seconds
+        self.connects = 0
+        self.connect_errors = 0
+        self.connect_time = 0
+        self.connect_max = 0
+
+    def listen(
+            self,
+            port=0,
+            host='127.0.0.1',
+            size=16384,
+            into=False,
+            reuseport=False,
+            workers=0,
+            serve=None,
+            batch=64,
+            max_connections=0,
+            tls=None,
+            timeout=-1):
+        """
+        Listens on *host*:*port* and returns a Recver of new connections. The
+        bound port is available as the Recver's *port*.
+
+        Up to *batch* connections are accepted for each wake up before other
+        green threads get a turn, and up to *batch* accepted connections are
+        buffered for a slow consumer. Connections are only registered with
+        the poller as they're received.
+
+        If *max_connections* is set, the listening socket stops being polled
+        while that many connections are open, leaving new ones in the
+        kernel's backlog.
+
+        The Recver counts connections *accepted*, *rejected* by accept errors
+        such as running out of fds, *queued* waiting for the consumer, and
+        *connections* currently open.
 
-    def listen(self, port=0, host='127.0.0.1'):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((host, port))
+        If *tls* is set to an SSLContext, connections are wrapped with TLS.
+        Each handshake runs on its own green thread, so a slow client doesn't
+        hold up the others, and connections are received as their handshakes
+        complete. Handshakes which fail, or don't complete within *timeout*
+        milliseconds, close the connection and are counted as *rejected*.
+
+        *reuseport* sets SO_REUSEPORT, so a number of processes can each
+        listen on the same port, and the kernel balances new connections
+        between them.
+
+        If *workers* is set, that many worker processes are forked instead,
+        each with its own Hub and its own SO_REUSEPORT listener, and a
+        `Supervisor` of them is returned. Each worker runs *serve(hub,
+        server)*, where server is its Recver of new connections. Workers
+        which die are restarted.
+        """
+        if workers:
+            return Supervisor(
+                self.hub, port, host, workers, serve,
+                size=size,
+                into=into,
+                batch=batch,
+                max_connections=max_connections,
+                tls=tls,
+                timeout=timeout)
+
+        sock = bind(host, port, reuseport=reuseport)
         sock.listen(socket.SOMAXCONN)
         sock.setblocking(0)
         port = sock.getsockname()[1]
-        server = self.hub.register(sock.fileno(), vanilla.poll.POLLIN)
-
-        @server.pipe
-        def server(upstream, downstream):
-            for mask in upstream:
-                while True:
-                    try:
-                        conn, host = sock.accept()
-                        downstream.send(self.hub.io.socket(conn))
-                    except (socket.error, OSError), e:
-                        if e.errno == errno.EAGAIN:
-                            break
-                        raise
-            self.hub.unregister(sock.fileno())
-            sock.close()
+        fileno = sock.fileno()
+        ready = self.hub.register(fileno, vanilla.poll.POLLIN)
+        # set whenever a connection closes
+        closed = self.hub.state()
+
+        @ready.pipe
+        def accepted(upstream, downstream):
+            try:
+                for mask in upstream:
+                    n = 0
+                    while True:
+                        if max_connections and \
+                                server.connections >= max_connections:
+                            self.hub.poll.modify(fileno)
+                            while server.connections >= max_connections:
+                                closed.clear().recv()
+                                if server.halted:
+                                    # closed while paused; the socket's no
+                                    # longer registered to be modified
+                                    return
+                            self.hub.poll.modify(fileno, vanilla.poll.POLLIN)
+
+                        try:
+                            conn, host = sock.accept()
+                        except (socket.error, OSError), e:
+                            if e.errno == errno.EAGAIN:
+                                self.hub.poll.rearm(
+                                    fileno, vanilla.poll.POLLIN)
+                                break
+                            if e.errno == errno.ECONNABORTED:
+                                server.rejected += 1
+                                continue
+                            if e.errno in (errno.EMFILE, errno.ENFILE):
+                                # back off until some fds are freed
+                                server.rejected += 1
+                                self.hub.sleep(100)
+                                continue
+                            raise
+
+                        server.accepted += 1
+                        server.queued += 1
+                        server.connections += 1
+                        downstream.send(conn)
+
+                        n += 1
+                        if n == batch:
+                            n = 0
+                            self.hub.sleep(0)
+            finally:
+                self.hub.unregister(fileno)
+                sock.close()
+
+        def release():
+            server.connections -= 1
+            closed.send(True)
 
+        def wrap(conn):
+            server.queued -= 1
+            conn = self.hub.io.socket(conn, size=size, into=into)
+            conn.onclose(release)
+            return conn
+
+        def stop():
+            # closing the server stops listening, by closing the registration
+            # the accept loop is waiting on. unless that's already happened,
+            # and the fd could have been reused
+            try:
+                sock.fileno()
+            except socket.error:
+                return
+            self.hub.unregister(fileno)
+            # wake the accept loop if it's paused at max_connections
+            closed.send(True)
+
+        def secure(conn, handshaked):
+            try:
+                conn = self.hub.io.tls(
+                    conn,
+                    context=tls,
+                    server_side=True,
+                    timeout=timeout,
+                    size=size,
+                    into=into)
+            except Exception, e:
+                log.debug('tls handshake failed: %s', e)
+                server.queued -= 1
+                server.rejected += 1
+                release()
+                return
+            server.queued -= 1
+            conn.onclose(release)
+            try:
+                handshaked.send(conn)
+            except vanilla.exception.Halt:
+                conn.close()
+
+        if tls:
+            handshaked = self.hub.router()
+            accepted.pipe(self.hub.queue(batch)).consume(
+                lambda conn: self.hub.spawn(secure, conn, handshaked.sender))
+            server = handshaked.recver
+        else:
+            server = accepted.pipe(self.hub.queue(batch)).map(wrap)
+        server.onclose(stop)
         server.port = port
+        server.accepted = server.rejected = 0
+        server.queued = server.connections = 0
         return server
 
-    def connect(self, port, host='127.0.0.1'):
+    def connect(
+            self,
+            port,
+            host='127.0.0.1',
+            size=16384,
+            into=False,
+            timeout=-1,
+            tls=None):
+        """
+        Connects to *host*:*port* without blocking the hub, and returns a Pair
+        for the connection. Raises vanilla.Timeout if the connection isn't
+        made within *timeout* milliseconds, or socket.error if it fails.
+
+        If *tls* is set the connection is wrapped with TLS, using *tls* as the
+        SSLContext, or the hub's shared client context if it's just True. The
+        handshake counts towards the *timeout*.
+        """
+        self.connects += 1
+        start = self.hub.clock()
+
         conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # TODO: this shouldn't block on the connect
-        conn.connect((host, port))
-        return self.hub.io.socket(conn)
+        conn.setblocking(0)
+        try:
+            err = conn.connect_ex((host, port))
+            if err == errno.EINPROGRESS:
+                ready = self.hub.register(
+                    conn.fileno(), vanilla.poll.POLLOUT)
+                try:
+                    ready.recv(timeout=timeout)
+                except vanilla.exception.Halt:
+                    # an error on the socket closes ready; SO_ERROR says why
+                    pass
+                finally:
+                    self.hub.unregister(conn.fileno())
+                err = conn.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, os.strerror(err))
+        except BaseException:
+            self.connect_errors += 1
+            conn.close()
+            raise
+
+        elapsed = self.hub.clock() - start
+        self.connect_time += elapsed
+        self.connect_max = max(self.connect_max, elapsed)
+
+        if tls:
+            if timeout >= 0:
+                timeout = max(0, timeout - elapsed * 1000)
+            try:
+                return self.hub.io.tls(
+                    conn,
+                    context=tls if isinstance(tls, ssl.SSLContext) else None,
+                    server_hostname=host,
+                    timeout=timeout,
+                    size=size,
+                    into=into)
+            except BaseException:
+                self.connect_errors += 1
+                raise
+        return self.hub.io.socket(conn, size=size, into=into)
+
+
+class Supervisor(object):
+    """
+    Runs *workers* processes, each accepting connections for *host*:*port*
+    on its own SO_REUSEPORT listener, and restarts any that die.
+
+    The supervisor holds a bound, but not listening, socket for the port, so
+    the port stays reserved across restarts and *port* can be 0.
+    """
+    def __init__(self, hub, port, host, workers, serve, **kw):
+        self.hub = hub
+        self.host = host
+        self.serve = serve
+        self.kw = kw
+
+        self.sock = bind(host, port, reuseport=True)
+        self.port = self.sock.getsockname()[1]
+
+        self.closed = False
+        self.restarts = 0
+        self.workers = []
+        for _ in xrange(workers):
+            self.start()
+
+    def start(self):
+        child = self.hub.process.launch(self.worker, stderrtoout=True)
+        self.workers.append(child)
+        child.stdout.consume(sys.stderr.write)
+        started = self.hub.now()
+
+        @self.hub.spawn
+        def _():
+            child.done.recv()
+            self.workers.remove(child)
+            if self.closed:
+                return
+            log.warn(
+                'worker %s exited: %s, restarting', child.pid, child.exitcode)
+            # don't spin on a worker which fails straight away
+            if self.hub.now() - started < 1:
+                self.hub.sleep(1000)
+            if self.closed:
+                return
+            self.restarts += 1
+            self.start()
+
+    def worker(self):
+        # runs in the forked child, which mustn't return to the parent's code
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            self.sock.close()
+            h = vanilla.Hub()
+            server = h.tcp.listen(
+                port=self.port, host=self.host, reuseport=True, **self.kw)
+            h.spawn(self.serve, h, server)
+            h.stop_on_term()
+        except Exception, e:
+            log.exception(e)
+            os._exit(1)
+        os._exit(0)
+
+    def close(self):
+        """
+        Stops restarting workers, and terminates those running.
+        """
+        self.closed = True
+        for child in self.workers:
+            child.terminate()
+        self.sock.close()
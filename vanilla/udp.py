@@ -60,6 +60,7 @@ def Recver(hub, sock):
                     got = sock.recvfrom(65507)
                 except (socket.error, OSError), e:
                     if e.errno == errno.EAGAIN:
+                        hub.poll.rearm(sock.fileno(), vanilla.poll.POLLIN)
                         break
                     sender.close()
                     return